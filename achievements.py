@@ -0,0 +1,267 @@
+from collections import OrderedDict
+from datetime import date
+import threading
+import numpy as np
+from db import db_connection
+from async_db import fetch_all
+from leaderboard import latest_ranking
+from price_engine import register_tick_handler
+from user_state import USER_STATE_CHANNEL
+
+# Number of users whose unlocked badges each process keeps in memory
+CACHE_SIZE = 10000
+
+# A badge unlocked once a per-user stat reaches a threshold. Stats come
+# from three kinds of event:
+#   signup - total_value (starting cash) when the user is created
+#   trade  - trade_count, day_trade_count (trades today) and streak_days
+#            (consecutive trading days), maintained by the trade statement
+#   tick   - rank, total_value and green_days (consecutive days in
+#            profit), computed on the price engine leader after each tick
+# A rule is checked whenever an event carries its stat.
+class Rule:
+    def __init__(self, name, icon, stat, at_least=None, at_most=None):
+        self.name = name
+        self.icon = icon
+        self.stat = stat
+        self.at_least = at_least
+        self.at_most = at_most
+
+    def check(self, value):
+        if value is None:
+            return False
+        if self.at_least is not None and value < self.at_least:
+            return False
+        if self.at_most is not None and value > self.at_most:
+            return False
+        return True
+
+    # Vectorised check over an array of stat values
+    def check_array(self, values):
+        passed = np.ones(len(values), dtype=bool)
+        if self.at_least is not None:
+            passed &= values >= self.at_least
+        if self.at_most is not None:
+            passed &= values <= self.at_most
+        return passed
+
+# Every badge, in display order
+RULES = [
+    Rule('First Trade', '🎯', 'trade_count', at_least=1),
+    Rule('10 Day Streak', '🔥', 'streak_days', at_least=10),
+    Rule('Green Week', '💚', 'green_days', at_least=7),
+    Rule('$100K Portfolio', '💎', 'total_value', at_least=100000),
+    Rule('Top 100', '🏆', 'rank', at_most=100),
+    Rule('Day Trader', '⚡', 'day_trade_count', at_least=10)
+]
+
+# Unlock badges in one statement, ignoring ones already held and users
+# not on the gamified platform. pairs is a list of (user_id, badge name).
+# Bumps each affected user's achievements_version (and state_version, see
+# user_state.py) and returns the pairs that were actually new.
+def unlock(cur, pairs):
+    if not pairs:
+        return []
+    cur.execute('''
+        WITH unlocked AS (
+            INSERT INTO achievements (user_id, session_id, achievement_name)
+            SELECT u.user_id, u.session_id, v.name
+            FROM unnest(%s::int[], %s::varchar[]) AS v(user_id, name)
+            JOIN users u ON u.user_id = v.user_id
+            WHERE u.platform_type = 'gamified'
+            ON CONFLICT (user_id, achievement_name) DO NOTHING
+            RETURNING user_id, achievement_name
+        ),
+        bumped AS (
+            UPDATE users u
+            SET achievements_version = achievements_version + c.unlocked,
+                state_version = state_version + 1
+            FROM (SELECT user_id, count(*) AS unlocked FROM unlocked GROUP BY user_id) c
+            WHERE u.user_id = c.user_id
+            RETURNING pg_notify(%s, json_build_object(
+                'user_id', u.user_id, 'version', u.state_version)::text)
+        )
+        SELECT user_id, achievement_name FROM unlocked
+    ''', ([user_id for user_id, _ in pairs], [name for _, name in pairs], USER_STATE_CHANNEL))
+    return [(row['user_id'], row['achievement_name']) for row in cur.fetchall()]
+
+# Per-process cache of each user's unlocked badges, keyed by user and
+# validated against the achievements_version on the user's row, which the
+# request has already loaded. A hit costs no query.
+class UnlockedCache:
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, version):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user_id, version, names):
+        with self._lock:
+            self._entries[user_id] = (version, frozenset(names))
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+_cache = UnlockedCache()
+
+UNLOCKED_SQL = '''
+    SELECT achievement_name
+    FROM achievements
+    WHERE user_id = %s
+'''
+
+# Get the names of a user's unlocked badges, given the achievements_version
+# from their user row
+def get_unlocked(user_id, version):
+    unlocked = _cache.get(user_id, version)
+    if unlocked is not None:
+        return unlocked
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(UNLOCKED_SQL, (user_id,))
+        names = [row['achievement_name'] for row in cur.fetchall()]
+        cur.close()
+
+    _cache.put(user_id, version, names)
+    return frozenset(names)
+
+# get_unlocked() for the ASGI app; a cache miss is read on its own async
+# pooled connection
+async def get_unlocked_async(user_id, version):
+    unlocked = _cache.get(user_id, version)
+    if unlocked is not None:
+        return unlocked
+
+    names = [row['achievement_name'] for row in await fetch_all(UNLOCKED_SQL, (user_id,))]
+    _cache.put(user_id, version, names)
+    return frozenset(names)
+
+def _badges(unlocked):
+    return [
+        {'name': rule.name, 'icon': rule.icon, 'unlocked': rule.name in unlocked}
+        for rule in RULES
+    ]
+
+# All badges with their unlocked state, for display. user is the row from
+# user_context.load_user().
+def list_achievements(user):
+    return _badges(get_unlocked(user['user_id'], user['achievements_version']))
+
+async def list_achievements_async(user):
+    return _badges(await get_unlocked_async(user['user_id'], user['achievements_version']))
+
+# Evaluate the rules that apply to one user's event and unlock any newly
+# earned badges, committing them. stats maps stat name -> value.
+# Returns the names of the badges unlocked.
+def _evaluate_user(user_id, version, stats):
+    unlocked = get_unlocked(user_id, version)
+    earned = [
+        rule.name for rule in RULES
+        if rule.stat in stats and rule.name not in unlocked and rule.check(stats[rule.stat])
+    ]
+    if not earned:
+        return []
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        new = unlock(cur, [(user_id, name) for name in earned])
+        cur.close()
+        conn.commit()
+
+    names = [name for _, name in new]
+    if names:
+        _cache.put(user_id, version + len(names), unlocked | set(names))
+    return names
+
+# A user was just created; user is the row from user_context.load_user()
+def on_signup(user):
+    names = _evaluate_user(user['user_id'], user['achievements_version'],
+                           {'total_value': user['current_cash'], 'trade_count': 0})
+    user['achievements_version'] += len(names)
+    return names
+
+# A trade filled; result is a successful execute_trade() result
+def on_trade(result):
+    return _evaluate_user(result['user_id'], result['achievements_version'], result['stats'])
+
+# Tick-driven rules, evaluated on the price engine leader for every user at
+# once from the leaderboard's latest ranking. Green days are advanced only
+# for users newly in profit today, and badges this process has already
+# awarded are skipped without touching the database.
+class TickEvaluator:
+    def __init__(self):
+        self._day = None
+        self._green_today = set()
+        self._awarded = {rule.name: np.empty(0, dtype=np.int64) for rule in RULES}
+
+    def evaluate(self, conn, snapshot):
+        ranking = latest_ranking()
+        if ranking is None or ranking['version'] != snapshot.version:
+            return
+
+        today = date.today()
+        if today != self._day:
+            self._day = today
+            self._green_today = set()
+
+        user_ids = ranking['user_ids']
+        profitable = user_ids[ranking['returns'] > 0]
+        newly_green = [int(user_id) for user_id in profitable if int(user_id) not in self._green_today]
+
+        with conn.transaction():
+            cur = conn.cursor()
+            green_ids = np.empty(0, dtype=np.int64)
+            green_days = np.empty(0, dtype=np.int64)
+            if newly_green:
+                # A missed day (not in profit at any tick) restarts the run
+                cur.execute('''
+                    UPDATE users
+                    SET green_days = CASE WHEN green_day = CURRENT_DATE - 1 THEN green_days + 1 ELSE 1 END,
+                        green_day = CURRENT_DATE
+                    WHERE user_id = ANY(%s) AND (green_day IS NULL OR green_day < CURRENT_DATE)
+                    RETURNING user_id, green_days
+                ''', (newly_green,))
+                rows = cur.fetchall()
+                green_ids = np.array([row['user_id'] for row in rows], dtype=np.int64)
+                green_days = np.array([row['green_days'] for row in rows], dtype=np.int64)
+                self._green_today.update(newly_green)
+
+            stats = {
+                'rank': (user_ids, ranking['ranks']),
+                'total_value': (user_ids, ranking['total_values']),
+                'green_days': (green_ids, green_days)
+            }
+            pairs = []
+            awarded = {}
+            for rule in RULES:
+                if rule.stat not in stats:
+                    continue
+                ids, values = stats[rule.stat]
+                earned = ids[rule.check_array(values)]
+                earned = earned[~np.isin(earned, self._awarded[rule.name])]
+                pairs.extend((int(user_id), rule.name) for user_id in earned)
+                awarded[rule.name] = np.union1d(self._awarded[rule.name], earned)
+
+            unlock(cur, pairs)
+            cur.close()
+
+        self._awarded.update(awarded)
+
+_tick_evaluator = TickEvaluator()
+
+def _evaluate_on_tick(conn, snapshot):
+    _tick_evaluator.evaluate(conn, snapshot)
+
+# Evaluate tick-driven badges on this app's price engine. Must be set up
+# after the leaderboard, whose ranking it reads. Both apps register it:
+# whichever process wins the engine leader lock maintains the badges.
+def init_app(app):
+    register_tick_handler(_evaluate_on_tick)
@@ -0,0 +1,218 @@
+from flask.cli import with_appcontext
+from datetime import datetime, timedelta
+from psycopg.rows import tuple_row
+import psycopg
+import pyarrow as pa
+import pyarrow.parquet as pq
+import os
+import json
+import click
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Columnar export of clickstream, trades and users for offline analysis of
+# the two platforms. Each run appends the rows written since the last one
+# as Parquet files, laid out for hive-partitioned readers (pyarrow.dataset,
+# DuckDB, Spark):
+#
+#     <output>/<table>/date=2026-10-17/platform=gamified/part-<until>.parquet
+#
+# Rows are read through a server-side cursor in bounded chunks, in time
+# order, so each day's files are finished and closed before the next day's
+# are started and neither side holds more than a day's open files in
+# memory. The export runs on a read-only connection of its own (point
+# ANALYTICS_DATABASE_URL at a replica to keep it off the primary).
+# Session ids are identity cookies and are never exported; clickstream
+# carries a hash of them, to group events from sessions without a user.
+
+# Directory the tables are exported under
+EXPORT_DIR = os.environ.get('ANALYTICS_EXPORT_DIR', 'exports')
+# Rows fetched from the server per round trip
+CHUNK_SIZE = int(os.environ.get('ANALYTICS_EXPORT_CHUNK_SIZE', 10000))
+# Seconds a row must be old before it is exported. Covers rows stamped
+# before they are committed: buffered clickstream events and trades in
+# flight, which would otherwise land behind the watermark and be skipped.
+EXPORT_LAG = float(os.environ.get('ANALYTICS_EXPORT_LAG', 60))
+COMPRESSION = 'zstd'
+
+# What each table exports, as (query, schema). The query takes the
+# (since, until] time window and returns each row's date and platform
+# first, which pick its file and are not stored in it, then the schema's
+# columns in order, ordered by time.
+EXPORTS = {
+    'clickstream': ('''
+        SELECT c.timestamp::date, COALESCE(u.platform_type, 'unknown'),
+               c.click_id, c.user_id, md5(c.session_id), c.event_type,
+               c.event_data::text, c.page_url, c.timestamp
+        FROM clickstream c
+        LEFT JOIN users u ON u.user_id = c.user_id
+        WHERE c.timestamp > %s AND c.timestamp <= %s
+        ORDER BY c.timestamp, c.click_id
+    ''', pa.schema([
+        ('click_id', pa.int64()),
+        ('user_id', pa.int64()),
+        ('session_key', pa.string()),
+        ('event_type', pa.string()),
+        ('event_data', pa.string()),
+        ('page_url', pa.string()),
+        ('timestamp', pa.timestamp('us'))
+    ])),
+    'trades': ('''
+        SELECT t.timestamp::date, u.platform_type,
+               t.trade_id, t.user_id, t.symbol, t.action, t.shares,
+               t.price, t.total_cost, t.timestamp
+        FROM trades t
+        JOIN users u ON u.user_id = t.user_id
+        WHERE t.timestamp > %s AND t.timestamp <= %s
+        ORDER BY t.timestamp, t.trade_id
+    ''', pa.schema([
+        ('trade_id', pa.int64()),
+        ('user_id', pa.int64()),
+        ('symbol', pa.string()),
+        ('action', pa.string()),
+        ('shares', pa.int32()),
+        ('price', pa.decimal128(10, 2)),
+        ('total_cost', pa.decimal128(12, 2)),
+        ('timestamp', pa.timestamp('us'))
+    ])),
+    # Users by signup. Balances and trade stats change, so they are left
+    # to be derived from the exported trades.
+    'users': ('''
+        SELECT u.created_at::date, u.platform_type,
+               u.user_id, u.initial_cash, u.created_at
+        FROM users u
+        WHERE u.created_at > %s AND u.created_at <= %s
+        ORDER BY u.created_at, u.user_id
+    ''', pa.schema([
+        ('user_id', pa.int64()),
+        ('initial_cash', pa.decimal128(12, 2)),
+        ('created_at', pa.timestamp('us'))
+    ]))
+}
+
+WATERMARK_FILE = '_watermark.json'
+PART_PREFIX = 'part-'
+PART_SUFFIX = '.parquet'
+PART_STAMP = '%Y%m%dT%H%M%S%f'
+
+# The time up to which a table has been exported, or datetime.min
+def read_watermark(table_dir):
+    try:
+        with open(os.path.join(table_dir, WATERMARK_FILE)) as f:
+            return datetime.fromisoformat(json.load(f)['until'])
+    except FileNotFoundError:
+        return datetime.min
+
+# Record a finished run, replacing the file in one step
+def _write_watermark(table_dir, until, rows):
+    path = os.path.join(table_dir, WATERMARK_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'until': until.isoformat(), 'rows': rows, 'exported_at': datetime.now().isoformat()}, f)
+    os.replace(path + '.tmp', path)
+
+# Remove what a failed run left behind: unfinished files, and finished
+# files past the watermark, from a run that died before recording it.
+# A rerun exports their rows again.
+def _discard_unrecorded(table_dir, since):
+    for directory, _, files in os.walk(table_dir):
+        for name in files:
+            if name.endswith('.tmp'):
+                os.remove(os.path.join(directory, name))
+            elif name.startswith(PART_PREFIX) and name.endswith(PART_SUFFIX):
+                stamp = name[len(PART_PREFIX):-len(PART_SUFFIX)]
+                if datetime.strptime(stamp, PART_STAMP) > since:
+                    os.remove(os.path.join(directory, name))
+
+def _close_writers(writers):
+    for writer in writers.values():
+        writer.close()
+    writers.clear()
+
+# Export one table's rows stamped after its watermark and up to until,
+# one file per date and platform. Returns the number of rows exported.
+def export_table(conn, name, output_dir, until, chunk_size=CHUNK_SIZE):
+    query, schema = EXPORTS[name]
+    table_dir = os.path.join(output_dir, name)
+    os.makedirs(table_dir, exist_ok=True)
+
+    since = read_watermark(table_dir)
+    if until <= since:
+        return 0
+    _discard_unrecorded(table_dir, since)
+
+    part = f'{PART_PREFIX}{until.strftime(PART_STAMP)}{PART_SUFFIX}'
+    # The current day's writers, by platform
+    writers = {}
+    current_day = None
+    paths = []
+    rows = 0
+    try:
+        with conn.transaction():
+            cur = conn.cursor(name=f'export_{name}', row_factory=tuple_row)
+            cur.execute(query, (since, until))
+            while True:
+                chunk = cur.fetchmany(chunk_size)
+                if not chunk:
+                    break
+
+                groups = {}
+                for row in chunk:
+                    groups.setdefault((row[0], row[1]), []).append(row[2:])
+
+                # Rows come in time order, so once a later day starts the
+                # earlier one's files are complete
+                for (day, platform), group in groups.items():
+                    if day != current_day:
+                        _close_writers(writers)
+                        current_day = day
+                    writer = writers.get(platform)
+                    if writer is None:
+                        directory = os.path.join(table_dir, f'date={day.isoformat()}', f'platform={platform}')
+                        os.makedirs(directory, exist_ok=True)
+                        paths.append(os.path.join(directory, part))
+                        writer = writers[platform] = pq.ParquetWriter(
+                            paths[-1] + '.tmp', schema, compression=COMPRESSION)
+                    columns = zip(*group)
+                    writer.write_table(pa.Table.from_arrays(
+                        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                        schema=schema
+                    ))
+                rows += len(chunk)
+            cur.close()
+    finally:
+        _close_writers(writers)
+
+    for path in paths:
+        os.replace(path + '.tmp', path)
+    _write_watermark(table_dir, until, rows)
+    return rows
+
+# Export every table (or the given ones) up to EXPORT_LAG ago by the
+# database's clock, which stamps the rows, from ANALYTICS_DATABASE_URL
+# (default: DATABASE_URL).
+# Returns a dict of table name -> rows exported.
+def export_all(output_dir=EXPORT_DIR, tables=None):
+    conn = psycopg.connect(os.environ.get('ANALYTICS_DATABASE_URL') or os.environ.get('DATABASE_URL'))
+    conn.read_only = True
+    try:
+        with conn.transaction():
+            now = conn.execute('SELECT LOCALTIMESTAMP').fetchone()[0]
+        until = now - timedelta(seconds=EXPORT_LAG)
+        return {name: export_table(conn, name, output_dir, until) for name in tables or EXPORTS}
+    finally:
+        conn.close()
+
+@click.command('export-analytics')
+@click.option('--output', default=EXPORT_DIR, help='Directory to export under (default: ANALYTICS_EXPORT_DIR).')
+@click.option('--table', 'tables', multiple=True, type=click.Choice(list(EXPORTS)),
+              help='Table to export (default: all). May be repeated.')
+@with_appcontext
+def export_analytics_command(output, tables):
+    """Export new clickstream, trades and users rows as Parquet."""
+    for name, rows in export_all(output, tables).items():
+        click.echo(f"{name}: {rows} rows")
+
+# Register the export command with a Flask app
+def init_app(app):
+    app.cli.add_command(export_analytics_command)
@@ -0,0 +1,64 @@
+from flask import Flask, request, session, redirect, url_for
+import os
+from dotenv import load_dotenv
+from migrations import ensure_schema
+from core import init_core
+from gamified_platform import bp as gamified_bp
+from traditional_platform import bp as traditional_bp
+
+load_dotenv()
+
+BLUEPRINTS = {
+    'gamified': gamified_bp,
+    'traditional': traditional_bp
+}
+# Platform for new sessions on the combined app
+DEFAULT_PLATFORM = os.environ.get('DEFAULT_PLATFORM', 'gamified')
+# Hosts that open one platform on the combined app, as comma-separated
+# host=platform pairs (e.g. "play.example.com=gamified,trade.example.com=traditional")
+PLATFORM_HOSTS = dict(
+    entry.strip().split('=', 1)
+    for entry in os.environ.get('PLATFORM_HOSTS', '').split(',') if '=' in entry
+)
+
+# The platform for a request (Flask's or Quart's) to the site root: the
+# one for its host, else the session's own, else the default
+def platform_for(request, session):
+    platform = PLATFORM_HOSTS.get(request.host.split(':')[0]) or session.get('platform')
+    if platform not in BLUEPRINTS:
+        platform = DEFAULT_PLATFORM
+    return platform
+
+# Send the site root to platform_for() this request
+def choose_platform():
+    return redirect(url_for(f'{platform_for(request, session)}.index'))
+
+# Application factory. With a platform, serve just that one at the site
+# root, as when each platform ran as its own app. Without, serve both from
+# one process and one set of caches, at /gamified/ and /traditional/.
+#
+# Serve it with a threaded worker, so open live streams (price_stream.py)
+# don't hold up other requests; under gunicorn's default sync worker pages
+# don't stream.
+#
+#     gunicorn -k gthread --threads 16 'app:create_app()'
+#     gunicorn -k gthread --threads 16 'app:create_app("traditional")'
+def create_app(platform=None):
+    app = Flask(__name__)
+    app.secret_key = os.environ.get('SECRET_KEY', 'change-this-in-production-please')
+    init_core(app)
+
+    if platform is not None:
+        app.register_blueprint(BLUEPRINTS[platform])
+    else:
+        for name, blueprint in BLUEPRINTS.items():
+            app.register_blueprint(blueprint, url_prefix=f'/{name}')
+        app.add_url_rule('/', 'choose_platform', choose_platform)
+
+    return app
+
+if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        ensure_schema()
+    app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
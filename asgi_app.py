@@ -0,0 +1,286 @@
+from quart import (Quart, Blueprint, Response, current_app, g, jsonify, redirect,
+                   render_template, request, session, url_for)
+import os
+import asyncio
+from dotenv import load_dotenv
+from migrations import ensure_schema
+from price_engine import ensure_engine_started
+from market_cache import get_snapshot
+from async_db import get_async_pool, close_async_pool, fetch_all
+from user_context import load_user_async, load_user_state_async
+from trading import execute_trade_async
+from leaderboard import get_top, get_rank_async
+from achievements import list_achievements_async, on_signup, on_trade
+from orders import cancel_order
+from price_stream import open_async_stream, streaming_enabled, stream_headers
+from dashboard_api import ENDPOINTS, Plan, is_fresh, tag_response
+from instrumentation import (METRICS_MIMETYPE, render_metrics, init_request_log,
+                             start_async_request, finish_request)
+from core import (init_handlers, failure, server_error, page_error, log_session_event,
+                  trade_event, market_price, check_platform)
+from app import platform_for
+import gamified_platform
+import traditional_platform
+
+load_dotenv()
+
+# ASGI serving mode: both platforms' pages, trades, orders and live streams
+# as async handlers on Quart, for an ASGI server. A page's independent
+# lookups (the user's state, rank, badges) each borrow a connection from
+# the async pool and run concurrently, and an open stream
+# waits on the event loop instead of holding a thread.
+#
+# Everything but the I/O is the WSGI app's own: the handlers here are thin
+# async wrappers around the same templates, order parsing and checks,
+# replies, platform binding, dashboard API (dashboard_api.py) and request
+# timings (instrumentation.py) as app.py's.
+#
+# Lookups that are cached in memory and only occasionally hit the database
+# (the market snapshot, the leaderboard top), and the rarer writes that
+# still use the sync pool (badges, resting orders), run on worker threads
+# so they never block the loop.
+#
+#     uvicorn --factory asgi_app:create_asgi_app
+#     gunicorn -k uvicorn.workers.UvicornWorker 'asgi_app:create_asgi_app("traditional")'
+
+gamified_bp = Blueprint('gamified', __name__)
+traditional_bp = Blueprint('traditional', __name__)
+
+BLUEPRINTS = {
+    'gamified': gamified_bp,
+    'traditional': traditional_bp
+}
+
+# The request's user, loaded at most once per request
+async def _load_user(platform):
+    if 'user' not in g:
+        g.user = await load_user_async(session, platform)
+    return g.user
+
+def _log_event(event_type, event_data=None):
+    log_session_event(session, request.url, event_type, event_data)
+
+# core.bind_platform() for this app
+def _bind_platform(platform):
+    reply = check_platform(request, session, platform, current_app.view_functions)
+    if isinstance(reply, str):
+        return redirect(url_for(reply))
+    return reply
+
+# core.execute_market_order() on the async pool
+async def _execute_market_order(symbol, action, shares):
+    price = await asyncio.to_thread(market_price, symbol, action, shares)
+    if price is None:
+        return {'success': False, 'reason': 'unknown_symbol'}
+
+    result = await execute_trade_async(session['session_id'], symbol, action, shares, price)
+    if result['success']:
+        _log_event('trade_completed', trade_event(symbol, action, shares, result))
+    return result
+
+async def _encode(events):
+    async for message in events:
+        yield message.encode()
+
+# price_stream.stream_response() for this app
+async def _stream_response(user):
+    if not streaming_enabled():
+        return Response('', status=204)
+    response = stream_headers(Response(_encode(await open_async_stream(user)), mimetype='text/event-stream'))
+    # Streams close themselves after price_stream.MAX_STREAM_AGE
+    response.timeout = None
+    return response
+
+# dashboard_api.respond() for this app: a plan's query runs on the async
+# pool, and a build without one (which may catch up a cache from the
+# database) on a worker thread
+async def _respond(plan):
+    if not isinstance(plan, Plan):
+        body, status = plan
+        return jsonify(body), status
+
+    if is_fresh(request, plan.etag):
+        response = Response('', status=304)
+    elif plan.query is not None:
+        response = jsonify(plan.build(await fetch_all(*plan.query)))
+    else:
+        response = jsonify(await asyncio.to_thread(plan.build, None))
+    return tag_response(response, plan.etag)
+
+def _api_view(plan, needs_user, load_user, market_view):
+    async def view(**kwargs):
+        user = await load_user() if needs_user else None
+        snapshot = await asyncio.to_thread(get_snapshot)
+        return await _respond(plan(user, snapshot, request.args, market_view, **kwargs))
+    return view
+
+# dashboard_api.init_app() for this app; load_user is a coroutine function
+def _init_dashboard_api(bp, load_user, market_view):
+    for rule, endpoint, needs_user, plan in ENDPOINTS:
+        bp.add_url_rule(rule, endpoint, _api_view(plan, needs_user, load_user, market_view))
+
+# Gamified platform
+
+@gamified_bp.before_request
+async def _bind_gamified():
+    return _bind_platform('gamified')
+
+async def _init_gamified_user():
+    user = await _load_user('gamified')
+    if user['created']:
+        # New users start with the badges their starting account earns
+        await asyncio.to_thread(on_signup, user)
+    return user
+
+@gamified_bp.route('/', endpoint='index')
+async def gamified_index():
+    try:
+        user = await _init_gamified_user()
+        _log_event('page_view', {'page': 'home'})
+
+        snapshot, top, state, achievements = await asyncio.gather(
+            asyncio.to_thread(get_snapshot),
+            asyncio.to_thread(get_top),
+            load_user_state_async(user),
+            list_achievements_async(user)
+        )
+        ranking = await state.memo_async('rank', top['version'], lambda: get_rank_async(user['user_id']))
+
+        context = gamified_platform.index_context(user, snapshot, state, top, ranking, achievements)
+        return await render_template('gamified.html', **context)
+
+    except Exception as e:
+        return page_error('Index', e)
+
+@gamified_bp.route('/trade', methods=['POST'], endpoint='trade')
+async def gamified_trade():
+    try:
+        if 'session_id' not in session or 'user_id' not in session:
+            await _init_gamified_user()
+
+        order = gamified_platform.parse_trade(await request.get_json())
+        if order is None:
+            return jsonify(failure('No data received'))
+
+        _log_event('trade_attempt', order)
+
+        refusal = gamified_platform.check_trade(order)
+        if refusal:
+            return jsonify(refusal)
+
+        result = await _execute_market_order(order['symbol'], order['action'], order['shares'])
+        unlocked = await asyncio.to_thread(on_trade, result) if result['success'] else []
+        return jsonify(gamified_platform.trade_reply(order, result, unlocked))
+
+    except Exception as e:
+        return jsonify(server_error('Trade', e))
+
+@gamified_bp.route('/stream', endpoint='stream')
+async def gamified_stream():
+    return await _stream_response(await _init_gamified_user())
+
+_init_dashboard_api(gamified_bp, _init_gamified_user, gamified_platform.get_market_data)
+
+# Traditional platform
+
+@traditional_bp.before_request
+async def _bind_traditional():
+    return _bind_platform('traditional')
+
+@traditional_bp.route('/', endpoint='index')
+async def traditional_index():
+    user = await _load_user('traditional')
+    _log_event('page_view', {'page': 'home'})
+
+    snapshot, state = await asyncio.gather(
+        asyncio.to_thread(get_snapshot),
+        load_user_state_async(user)
+    )
+
+    context = traditional_platform.index_context(user, snapshot, state)
+    return await render_template('traditional.html', **context)
+
+@traditional_bp.route('/trade', methods=['POST'], endpoint='trade')
+async def traditional_trade():
+    if 'session_id' not in session or 'user_id' not in session:
+        await _load_user('traditional')
+
+    data = await request.get_json()
+    order = traditional_platform.parse_order(data)
+    _log_event('trade_attempt', order)
+
+    refusal = traditional_platform.check_order(order)
+    if refusal:
+        return jsonify(refusal)
+
+    if order['order_type'] == 'market':
+        result = await _execute_market_order(order['symbol'], order['action'], order['shares'])
+    else:
+        user = await _load_user('traditional')
+        result = await asyncio.to_thread(traditional_platform.place_ticket, user, order,
+                                         traditional_platform.order_options(data))
+
+    for event_type, event_data in traditional_platform.order_events(order, result):
+        _log_event(event_type, event_data)
+    return jsonify(traditional_platform.order_reply(order, result))
+
+@traditional_bp.route('/orders/<int:order_id>/cancel', methods=['POST'], endpoint='cancel')
+async def traditional_cancel(order_id):
+    user = await _load_user('traditional')
+
+    cancelled = await asyncio.to_thread(cancel_order, user['user_id'], order_id)
+    if cancelled:
+        _log_event('order_cancelled', {'order_id': order_id})
+    return jsonify(traditional_platform.cancel_reply(cancelled))
+
+@traditional_bp.route('/stream', endpoint='stream')
+async def traditional_stream():
+    return await _stream_response(await _load_user('traditional'))
+
+_init_dashboard_api(traditional_bp, lambda: _load_user('traditional'), traditional_platform.get_market_data)
+
+async def choose_platform():
+    return redirect(url_for(f'{platform_for(request, session)}.index'))
+
+async def metrics():
+    return Response(render_metrics(), mimetype=METRICS_MIMETYPE)
+
+async def _start_request():
+    start_async_request(g)
+
+async def _finish_request(response):
+    return finish_request(g, request, response)
+
+# Bring up the schema, this worker's price engine and its async pool before
+# the first request, rather than checking on every request as the WSGI app
+# does
+async def _start_core():
+    await asyncio.to_thread(ensure_schema)
+    ensure_engine_started()
+    await get_async_pool()
+
+# Application factory, as app.create_app(): one platform at the site root,
+# or both at /gamified/ and /traditional/.
+def create_asgi_app(platform=None):
+    app = Quart(__name__)
+    app.secret_key = os.environ.get('SECRET_KEY', 'change-this-in-production-please')
+    # Instrumentation first so the other hooks' queries are counted
+    init_request_log()
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    init_handlers(app)
+    app.before_serving(_start_core)
+    app.after_serving(close_async_pool)
+    app.add_url_rule('/metrics', 'metrics', metrics)
+
+    if platform is not None:
+        app.register_blueprint(BLUEPRINTS[platform])
+    else:
+        for name, blueprint in BLUEPRINTS.items():
+            app.register_blueprint(blueprint, url_prefix=f'/{name}')
+        app.add_url_rule('/', 'choose_platform', choose_platform)
+
+    return app
+
+if __name__ == '__main__':
+    create_asgi_app().run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
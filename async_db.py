@@ -0,0 +1,80 @@
+from contextlib import asynccontextmanager
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+import os
+import time
+from dotenv import load_dotenv
+from db import POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_TIMEOUT, POOL_MAX_LIFETIME, POOL_MAX_IDLE
+from instrumentation import InstrumentedAsyncCursor, record_acquire
+
+load_dotenv()
+
+# Async connection pool for the ASGI app (see asgi_app.py), sized like the
+# sync pool in db.py. Connections are in autocommit mode: every statement
+# the async handlers run is a single atomic statement, so none of them
+# holds a transaction open across an await.
+
+_pool = None
+_pool_pid = None
+
+# Get the async pool for this process, opening it on first use. Must be
+# called from the event loop that will use it; each worker runs one loop.
+async def get_async_pool():
+    global _pool, _pool_pid
+
+    if _pool is None or _pool_pid != os.getpid():
+        pool = AsyncConnectionPool(
+            os.environ.get('DATABASE_URL'),
+            min_size=POOL_MIN_SIZE,
+            max_size=POOL_MAX_SIZE,
+            timeout=POOL_TIMEOUT,
+            max_lifetime=POOL_MAX_LIFETIME,
+            max_idle=POOL_MAX_IDLE,
+            kwargs={'row_factory': dict_row, 'cursor_factory': InstrumentedAsyncCursor, 'autocommit': True},
+            check=AsyncConnectionPool.check_connection,
+            name=f"trading-async-{os.getpid()}",
+            open=False
+        )
+        await pool.open()
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = pool
+            _pool_pid = os.getpid()
+        else:
+            # Another request opened one while this one was connecting
+            await pool.close()
+
+    return _pool
+
+# Borrow a connection for the duration of the block. Queries meant to run
+# concurrently (asyncio.gather) each need their own.
+@asynccontextmanager
+async def async_connection():
+    pool = await get_async_pool()
+    started = time.perf_counter()
+    conn = await pool.getconn()
+    record_acquire(time.perf_counter() - started)
+    try:
+        yield conn
+    finally:
+        await pool.putconn(conn)
+
+# Run one statement and return all its rows
+async def fetch_all(query, params=None):
+    async with async_connection() as conn:
+        cur = await conn.execute(query, params)
+        return await cur.fetchall()
+
+# Run one statement and return its first row, or None
+async def fetch_one(query, params=None):
+    async with async_connection() as conn:
+        cur = await conn.execute(query, params)
+        return await cur.fetchone()
+
+# Close the pool (used on shutdown)
+async def close_async_pool():
+    global _pool, _pool_pid
+
+    if _pool is not None and _pool_pid == os.getpid():
+        await _pool.close()
+    _pool = None
+    _pool_pid = None
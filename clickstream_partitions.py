@@ -0,0 +1,229 @@
+from flask.cli import with_appcontext
+from datetime import datetime, timedelta
+import os
+import re
+import time
+import threading
+import click
+import psycopg
+from db import db_connection
+from price_engine import register_tick_handler
+from instrumentation import register_collector
+
+# clickstream is range partitioned on timestamp (see migrations.py, version
+# 12). Partitions are created ahead of time and, if a retention period is
+# set, retired once they age out of it by a maintenance job, run hourly on the price engine leader
+# or by hand with 'flask maintain-clickstream'. Events that arrive before
+# their partition exists land in clickstream_default and are moved into
+# the partition when it is created.
+
+# Length of each partition: 'day' or 'week'. A change applies to partitions
+# created from then on.
+PARTITION_INTERVAL = os.environ.get('CLICKSTREAM_PARTITION_INTERVAL', 'day')
+# Days ahead of now that partitions are kept ready
+PREMAKE_DAYS = int(os.environ.get('CLICKSTREAM_PREMAKE_DAYS', 7))
+# Days of events kept in clickstream; 0 (the default) keeps them forever.
+# clickstream is the study's primary data, so nothing is retired unless
+# this is set.
+RETENTION_DAYS = int(os.environ.get('CLICKSTREAM_RETENTION_DAYS', 0))
+# What happens to a partition once all its events are past retention:
+#   archive - detach it and move it to the clickstream_archive schema (default)
+#   detach  - detach it, leaving a standalone table to export or drop by hand
+#   drop    - drop it, deleting its events for good; only if set explicitly
+RETENTION_ACTION = os.environ.get('CLICKSTREAM_RETENTION_ACTION', 'archive')
+# Seconds between maintenance runs on the price engine leader
+MAINTENANCE_INTERVAL = float(os.environ.get('CLICKSTREAM_MAINTENANCE_INTERVAL', 3600))
+
+PARTITION_INTERVALS = {'day': 1, 'week': 7}
+RETENTION_ACTIONS = ('drop', 'detach', 'archive')
+
+DEFAULT_PARTITION = 'clickstream_default'
+ARCHIVE_SCHEMA = 'clickstream_archive'
+# Arbitrary key for pg_try_advisory_xact_lock so only one maintenance job
+# runs at a time
+MAINTENANCE_LOCK_KEY = 7305003
+# Attaching and detaching lock clickstream briefly; rather than queue the
+# writers behind a long-running query, a run gives up and tries next time
+LOCK_TIMEOUT = '2s'
+
+_BOUNDS = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+# Start of the partition period containing a moment
+def _period_start(moment, interval):
+    start = datetime(moment.year, moment.month, moment.day)
+    if interval == 'week':
+        start -= timedelta(days=start.weekday())
+    return start
+
+# The clickstream partitions as (name, start, end), oldest first, leaving
+# out the default partition
+def list_partitions(cur):
+    cur.execute('''
+        SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'clickstream'::regclass
+    ''')
+    partitions = []
+    for row in cur.fetchall():
+        match = _BOUNDS.search(row['bound'])
+        if match:
+            partitions.append((row['name'],
+                               datetime.fromisoformat(match.group(1)),
+                               datetime.fromisoformat(match.group(2))))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+# Create one partition, moving in any of its events that were written to
+# the default partition, and return its name
+def _create_partition(cur, start, end):
+    name = f'clickstream_{start:%Y%m%d}'
+    cur.execute(f'CREATE TABLE {name} (LIKE clickstream INCLUDING DEFAULTS)')
+    cur.execute(f'''
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION}
+            WHERE timestamp >= %s AND timestamp < %s
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    ''', (start, end))
+    # Indexes, the primary key and the users foreign key are added to
+    # match clickstream's on attaching
+    cur.execute(f'''
+        ALTER TABLE clickstream ATTACH PARTITION {name}
+        FOR VALUES FROM ('{start:%Y-%m-%d %H:%M:%S}') TO ('{end:%Y-%m-%d %H:%M:%S}')
+    ''')
+    return name
+
+# Create partitions covering from now, or from the oldest event waiting in
+# the default partition if that is earlier, until PREMAKE_DAYS ahead. Runs
+# on from the end of the newest partition, and fills in before the oldest
+# one for any events from before it that are still in the default
+# partition (as on an install whose first partitions started ahead of its
+# first events).
+# Returns the names of the partitions created.
+def create_partitions(cur, now, interval=PARTITION_INTERVAL):
+    if interval not in PARTITION_INTERVALS:
+        raise ValueError(f"Unknown clickstream partition interval: {interval}")
+    length = timedelta(days=PARTITION_INTERVALS[interval])
+    until = now + timedelta(days=PREMAKE_DAYS)
+
+    cur.execute(f'SELECT min(timestamp) AS first FROM {DEFAULT_PARTITION}')
+    first = cur.fetchone()['first']
+    start = _period_start(min(first, now) if first else now, interval)
+
+    created = []
+    partitions = list_partitions(cur)
+    if partitions:
+        oldest = partitions[0][1]
+        while start < oldest:
+            end = min(_period_start(start, interval) + length, oldest)
+            created.append(_create_partition(cur, start, end))
+            start = end
+        start = partitions[-1][2]
+
+    while start < until:
+        # The first one after a change of interval runs up to the next
+        # boundary, so later ones line up
+        end = _period_start(start, interval) + length
+        created.append(_create_partition(cur, start, end))
+        start = end
+    return created
+
+# Retire partitions whose events are all older than cutoff.
+# Returns the names of the partitions retired.
+def retire_partitions(cur, cutoff, action=RETENTION_ACTION):
+    if action not in RETENTION_ACTIONS:
+        raise ValueError(f"Unknown clickstream retention action: {action}")
+
+    retired = []
+    for name, _, end in list_partitions(cur):
+        if end > cutoff:
+            break
+        cur.execute(f'ALTER TABLE clickstream DETACH PARTITION {name}')
+        if action == 'drop':
+            cur.execute(f'DROP TABLE {name}')
+        elif action == 'archive':
+            cur.execute(f'CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}')
+            cur.execute(f'ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}')
+        retired.append(name)
+    return retired
+
+_stats_lock = threading.Lock()
+_stats = {'created': 0, 'retired': 0}
+
+# Create upcoming partitions and retire expired ones, in one transaction.
+# now defaults to the database's clock, which stamps the events.
+# Returns (created, retired) partition names, or None if another run holds
+# the maintenance lock.
+def maintain(conn, now=None):
+    with conn.transaction():
+        cur = conn.cursor()
+        cur.execute('SELECT pg_try_advisory_xact_lock(%s) AS acquired, LOCALTIMESTAMP AS now', (MAINTENANCE_LOCK_KEY,))
+        row = cur.fetchone()
+        if not row['acquired']:
+            cur.close()
+            return None
+        now = now or row['now']
+        cur.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+
+        created = create_partitions(cur, now)
+        retired = []
+        if RETENTION_DAYS > 0:
+            retired = retire_partitions(cur, now - timedelta(days=RETENTION_DAYS))
+        cur.close()
+
+    with _stats_lock:
+        _stats['created'] += len(created)
+        _stats['retired'] += len(retired)
+    return created, retired
+
+_last_run = None
+
+# Runs on the price engine leader after every tick, maintaining the
+# partitions at most once per MAINTENANCE_INTERVAL
+def _maintain_on_tick(conn, snapshot):
+    global _last_run
+
+    if _last_run is not None and time.monotonic() - _last_run < MAINTENANCE_INTERVAL:
+        return
+    _last_run = time.monotonic()
+
+    try:
+        result = maintain(conn)
+    except psycopg.errors.LockNotAvailable:
+        print("Clickstream maintenance skipped: clickstream is busy")
+        return
+    if result and any(result):
+        created, retired = result
+        print(f"Clickstream partitions created: {created or 'none'}, "
+              f"retired ({RETENTION_ACTION}): {retired or 'none'}")
+
+@click.command('maintain-clickstream')
+@with_appcontext
+def maintain_clickstream_command():
+    """Create upcoming clickstream partitions and retire expired ones."""
+    with db_connection() as conn:
+        result = maintain(conn)
+    if result is None:
+        click.echo('Clickstream maintenance is already running elsewhere.')
+        return
+    created, retired = result
+    click.echo(f"Created partitions: {', '.join(created) or 'none'}")
+    click.echo(f"Retired partitions ({RETENTION_ACTION}): {', '.join(retired) or 'none'}")
+
+# Maintenance counters for /metrics
+def _collect_metrics():
+    with _stats_lock:
+        stats = dict(_stats)
+    return [
+        ('trading_clickstream_partitions_total', 'counter',
+         'Clickstream partitions created and retired by this process.',
+         [({'change': 'created'}, stats['created']), ({'change': 'retired'}, stats['retired'])])
+    ]
+
+# Maintain the partitions from this app's price engine. Both apps register
+# it: whichever process wins the engine leader lock runs it.
+def init_app(app):
+    app.cli.add_command(maintain_clickstream_command)
+    register_tick_handler(_maintain_on_tick)
+    register_collector(_collect_metrics)
@@ -0,0 +1,224 @@
+from psycopg.types.json import Jsonb
+from datetime import timedelta
+import os
+import time
+import queue
+import atexit
+import threading
+from db import get_pool
+from instrumentation import register_collector
+
+# Flush once this many events are buffered...
+BATCH_SIZE = int(os.environ.get('CLICKSTREAM_BATCH_SIZE', 500))
+# ...or this many seconds after the oldest buffered event, whichever is first
+FLUSH_INTERVAL = float(os.environ.get('CLICKSTREAM_FLUSH_INTERVAL', 1.0))
+# Maximum number of events waiting to be written
+QUEUE_SIZE = int(os.environ.get('CLICKSTREAM_QUEUE_SIZE', 10000))
+# What to do when the queue is full:
+#   drop_newest - discard the new event (default, never slows a request down)
+#   drop_oldest - discard the oldest queued event to make room
+#   block       - wait up to CLICKSTREAM_BLOCK_TIMEOUT seconds, then drop
+OVERFLOW_POLICY = os.environ.get('CLICKSTREAM_OVERFLOW_POLICY', 'drop_newest')
+BLOCK_TIMEOUT = float(os.environ.get('CLICKSTREAM_BLOCK_TIMEOUT', 0.05))
+
+OVERFLOW_POLICIES = ('drop_newest', 'drop_oldest', 'block')
+
+# Buffers clickstream events in memory and writes them in batches with COPY
+# from a background thread, keeping the insert off the request path.
+class ClickstreamWriter:
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 queue_size=QUEUE_SIZE, overflow_policy=OVERFLOW_POLICY):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown clickstream overflow policy: {overflow_policy}")
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'dropped': 0,
+            'flushed': 0,
+            'failed': 0,
+            'batches': 0
+        }
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='clickstream-writer', daemon=True)
+        self._thread.start()
+
+    # Stop the worker after writing everything still queued
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    # Queue one event. Never raises; returns False if the event was dropped.
+    def log(self, user_id, session_id, event_type, event_data=None, page_url=None):
+        event = (
+            user_id,
+            session_id,
+            event_type,
+            Jsonb(event_data) if event_data else None,
+            page_url,
+            time.monotonic()
+        )
+
+        if self._offer(event):
+            self._count('enqueued')
+            return True
+
+        self._count('dropped')
+        return False
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queued'] = self._queue.qsize()
+        return stats
+
+    def _offer(self, event):
+        if self.overflow_policy == 'block':
+            try:
+                self._queue.put(event, timeout=BLOCK_TIMEOUT)
+                return True
+            except queue.Full:
+                return False
+
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            if self.overflow_policy == 'drop_newest':
+                return False
+
+        # drop_oldest: make room by discarding the head of the queue
+        try:
+            self._queue.get_nowait()
+            self._count('dropped')
+        except queue.Empty:
+            pass
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect_batch()
+            if batch:
+                self._flush(batch)
+
+        # Drain whatever is left on shutdown
+        while True:
+            batch = self._drain(self.batch_size)
+            if not batch:
+                break
+            self._flush(batch)
+
+    # Wait for the first event, then gather more until the batch is full
+    # or the flush interval has passed
+    def _collect_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    # Events are stamped on the database's clock, like trades and orders
+    # (CURRENT_TIMESTAMP), so they order correctly against them and against
+    # the partition bounds and export watermarks, whatever the app server's
+    # clock or timezone: each event's age when queued is taken off the
+    # database time read at flush.
+    def _flush(self, batch):
+        try:
+            with get_pool().connection() as conn:
+                cur = conn.cursor()
+                cur.execute('SELECT clock_timestamp()::timestamp AS now')
+                db_now = cur.fetchone()['now']
+                now = time.monotonic()
+                with cur.copy('''
+                    COPY clickstream (user_id, session_id, event_type, event_data, page_url, timestamp)
+                    FROM STDIN
+                ''') as copy:
+                    for event in batch:
+                        copy.write_row(event[:-1] + (db_now - timedelta(seconds=now - event[-1]),))
+                cur.close()
+            self._count('flushed', len(batch))
+            self._count('batches')
+        except Exception as e:
+            # Don't retry - clickstream is best effort and must not back up the app
+            print(f"Clickstream flush error ({len(batch)} events lost): {e}")
+            self._count('failed', len(batch))
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+# Get this process's clickstream writer, starting it on first use
+# (after gunicorn forks, so each worker has its own thread)
+def get_writer():
+    global _writer, _writer_pid
+
+    writer = _writer
+    if writer is not None and _writer_pid == os.getpid():
+        return writer
+
+    with _writer_lock:
+        if _writer is None or _writer_pid != os.getpid():
+            _writer = ClickstreamWriter()
+            _writer_pid = os.getpid()
+            _writer.start()
+            atexit.register(_writer.stop)
+
+    return _writer
+
+# Writer counters for /metrics
+def _collect_metrics():
+    if _writer is None or _writer_pid != os.getpid():
+        return []
+
+    stats = _writer.stats()
+    return [
+        ('trading_clickstream_events_total', 'counter', 'Clickstream events by outcome.',
+         [({'outcome': outcome}, stats[outcome]) for outcome in ('enqueued', 'dropped', 'flushed', 'failed')]),
+        ('trading_clickstream_batches_total', 'counter', 'Clickstream batches written.',
+         [({}, stats['batches'])]),
+        ('trading_clickstream_queued', 'gauge', 'Clickstream events waiting to be written.',
+         [({}, stats['queued'])])
+    ]
+
+# Register the writer's metrics with a Flask app
+def init_app(app):
+    register_collector(_collect_metrics)
@@ -0,0 +1,146 @@
+from flask import request, session, redirect, url_for, current_app
+import traceback
+from instrumentation import init_app as init_instrumentation
+from db import init_app as init_db_pool
+from migrations import init_app as init_migrations
+from price_engine import init_app as init_price_engine
+from analytics_export import init_app as init_analytics_export
+from market_cache import get_snapshot
+from clickstream_writer import get_writer as get_clickstream_writer, init_app as init_clickstream
+from clickstream_partitions import init_app as init_clickstream_partitions
+from trading import execute_trade
+from fill_model import fill_price
+from leaderboard import init_app as init_leaderboard
+from achievements import init_app as init_achievements
+from orders import init_app as init_orders
+from price_stream import init_app as init_price_stream
+from user_state import init_app as init_user_state
+
+# The trading core shared by both platforms: connection pool, schema,
+# price engine and its tick handlers, clickstream and live streams. Every
+# piece is a per-process singleton, so however many platforms an app
+# serves they share one warm set of caches and connections.
+
+# Messages for failed trades, keyed by execute_trade() reason
+TRADE_ERRORS = {
+    'invalid_action': 'Invalid action',
+    'user_not_found': 'User not found',
+    'insufficient_funds': 'Insufficient funds',
+    'insufficient_shares': 'Insufficient shares',
+    'unknown_symbol': 'Please select a symbol from the Market Data list'
+}
+
+# Set up the shared core on an app, before any platform is registered
+def init_core(app):
+    # Instrumentation first so the other hooks' queries are counted
+    init_instrumentation(app)
+    init_db_pool(app)
+    init_migrations(app)
+    init_price_engine(app)
+    init_analytics_export(app)
+    init_handlers(app)
+
+# The parts of the core that need nothing from the web framework: metrics
+# collectors and tick handlers. Shared with the ASGI app (asgi_app.py).
+def init_handlers(app):
+    init_clickstream(app)
+    init_price_stream(app)
+    init_user_state(app)
+    # Tick handlers, in order: the leaderboard's ranking feeds the
+    # achievements. Whichever process wins the engine leader lock runs
+    # them, for every platform.
+    init_leaderboard(app)
+    init_achievements(app)
+    init_orders(app)
+    init_clickstream_partitions(app)
+
+# The request handling shared by the WSGI app and the ASGI app
+# (asgi_app.py). Helpers take the framework's request and session, which
+# Flask and Quart shape alike, and return plain replies that both send
+# as-is: a dict is a JSON body, a (dict, status) pair one with that status.
+
+# A failed request's reply
+def failure(message):
+    return {'success': False, 'message': message}
+
+# Reply to a request that failed unexpectedly, after printing the error
+def server_error(route, e):
+    print(f"{route} route error: {e}")
+    traceback.print_exc()
+    return failure(f'Server error: {str(e)}')
+
+# Page for a page load that failed unexpectedly, after printing the error
+def page_error(route, e):
+    print(f"{route} route error: {e}")
+    traceback.print_exc()
+    return f"Error loading page: {str(e)}", 500
+
+# Log a clickstream event for a session's user, on the page at url.
+# Queued and written in batches by a background thread.
+def log_session_event(session, url, event_type, event_data=None):
+    if 'session_id' not in session:
+        return
+
+    get_clickstream_writer().log(
+        session.get('user_id'),
+        session['session_id'],
+        event_type,
+        event_data,
+        url
+    )
+
+# Log a clickstream event for this request's session
+def log_event(event_type, event_data=None):
+    log_session_event(session, request.url, event_type, event_data)
+
+# The trade_completed event for a filled execute_trade() result
+def trade_event(symbol, action, shares, result):
+    filled = result['trade']
+    return {
+        'symbol': symbol,
+        'shares': shares,
+        'action': action,
+        'price': filled['price'],
+        'total': filled['total']
+    }
+
+# The fill model's price for a market order at the current quote (buys at
+# the ask, sells at the bid), or None if the symbol isn't quoted
+def market_price(symbol, action, shares):
+    quote = get_snapshot().get(symbol)
+    if quote is None:
+        return None
+    return fill_price(quote, action, shares)
+
+# Fill a market order for the session's user at market_price() and log it.
+# Returns the execute_trade() result, with reason 'unknown_symbol' if the
+# symbol isn't quoted.
+def execute_market_order(symbol, action, shares):
+    price = market_price(symbol, action, shares)
+    if price is None:
+        return {'success': False, 'reason': 'unknown_symbol'}
+
+    result = execute_trade(session['session_id'], symbol, action, shares, price)
+    if result['success']:
+        log_event('trade_completed', trade_event(symbol, action, shares, result))
+    return result
+
+# A session belongs to the first platform it visits: users are keyed by
+# session, so one browser must stay in one arm of the experiment. Checks a
+# request for platform on an app serving view_functions. Returns None if it
+# may go on; otherwise a page load is sent to the session's own platform,
+# returned as the endpoint to redirect to, and anything else is refused.
+def check_platform(request, session, platform, view_functions):
+    assigned = session.setdefault('platform', platform)
+    if assigned == platform or f'{assigned}.index' not in view_functions:
+        return None
+    if request.method == 'GET' and request.endpoint == f'{platform}.index':
+        return f'{assigned}.index'
+    return failure(f'This session uses the {assigned} platform'), 409
+
+# check_platform() for this request, as a before_request hook
+def bind_platform(platform):
+    reply = check_platform(request, session, platform, current_app.view_functions)
+    if isinstance(reply, str):
+        return redirect(url_for(reply))
+    return reply
@@ -0,0 +1,212 @@
+from flask import request, jsonify, Response
+from collections import namedtuple
+from db import get_db_connection
+from market_cache import get_snapshot
+from portfolio import ACCOUNT_SQL, account_from_rows, value_portfolio
+from price_history import BAR_RESOLUTIONS, BARS_SQL, bars_from_rows, recent_ticks
+
+# Default and maximum page size for /api/history
+HISTORY_PAGE_SIZE = 20
+MAX_HISTORY_PAGE_SIZE = 100
+# Default and maximum number of bars for /api/bars
+BAR_COUNT = 60
+MAX_BAR_COUNT = 500
+
+# Trade history pages, newest first: the first page, and the page after a
+# given trade_id. Both fetch one row more than the page to tell whether
+# there is a next one.
+HISTORY_SQL = '''
+    SELECT trade_id, symbol, action, shares, price, total_cost, timestamp
+    FROM trades
+    WHERE user_id = %s
+    ORDER BY timestamp DESC, trade_id DESC
+    LIMIT %s
+'''
+HISTORY_BEFORE_SQL = '''
+    SELECT trade_id, symbol, action, shares, price, total_cost, timestamp
+    FROM trades
+    WHERE user_id = %s
+      AND (timestamp, trade_id) < (
+          SELECT timestamp, trade_id FROM trades WHERE trade_id = %s AND user_id = %s
+      )
+    ORDER BY timestamp DESC, trade_id DESC
+    LIMIT %s
+'''
+
+# How an endpoint answers, short of a response, so the WSGI app (here) and
+# the ASGI app (asgi_app.py) serve the same API with their own I/O: the
+# ETag, the (sql, params) to run if the client's copy is stale (or None)
+# and build(rows), which makes the JSON body from the rows (None without a
+# query). build() only runs on a cache miss, so a revalidation costs no
+# more than working out the ETag.
+Plan = namedtuple('Plan', 'etag query build')
+
+# Whether the client already holds this ETag. request is Flask's or Quart's.
+def is_fresh(request, etag):
+    return request.if_none_match.contains_weak(etag)
+
+# Mark a response (Flask's or Quart's) with its ETag
+def tag_response(response, etag):
+    response.set_etag(etag, weak=True)
+    # Browsers may keep the response but must revalidate it on every use
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _page_size(args):
+    try:
+        limit = int(args.get('limit', HISTORY_PAGE_SIZE))
+    except ValueError:
+        limit = HISTORY_PAGE_SIZE
+    return max(1, min(limit, MAX_HISTORY_PAGE_SIZE))
+
+def _format_trade(trade):
+    return {
+        'trade_id': trade['trade_id'],
+        'symbol': trade['symbol'],
+        'action': trade['action'],
+        'shares': trade['shares'],
+        'price': float(trade['price']),
+        'total': float(trade['total_cost']),
+        'timestamp': trade['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+# The endpoints. Each takes the request's user (None if it doesn't need
+# one), the market snapshot, the query string, the platform's market_view
+# (returning its (market_data list, symbol -> stock)) and the URL's
+# arguments, and returns a Plan, or an error reply (body, status).
+#
+# Everything a user sees changes either on a price tick or on one of their
+# trades, so ETags are built from the tick version and the user's trade
+# count, both already in hand before any further query runs.
+
+# Market table, as rendered by the platform
+def _market(user, snapshot, args, market_view):
+    def build(rows):
+        market_data, _ = market_view()
+        return {'version': snapshot.version, 'quotes': market_data}
+
+    return Plan(f'market-{snapshot.version}', None, build)
+
+# Open positions valued at current prices
+def _positions(user, snapshot, args, market_view):
+    def build(rows):
+        cash, held = account_from_rows(rows)
+        valuation = value_portfolio(held, snapshot, cash)
+        return {
+            'version': snapshot.version,
+            'positions': sorted(valuation.rows(), key=lambda row: row['symbol'])
+        }
+
+    return Plan(f"positions-{user['user_id']}-{user['trade_count']}-{snapshot.version}",
+                (ACCOUNT_SQL, (user['user_id'],)), build)
+
+# Cash, total value and trade statistics
+def _account(user, snapshot, args, market_view):
+    def build(rows):
+        cash, held = account_from_rows(rows)
+        valuation = value_portfolio(held, snapshot, cash)
+        change = valuation.total_value - user['initial_cash']
+        return {
+            'version': snapshot.version,
+            'cash': cash,
+            'positions_value': valuation.positions_value,
+            'unrealized_pnl': valuation.unrealized_pnl,
+            'total_value': valuation.total_value,
+            'change': change,
+            'change_percent': (change / user['initial_cash'] * 100) if user['initial_cash'] > 0 else 0,
+            'trade_count': user['trade_count'],
+            'realized_pnl': user['realized_pnl'],
+            'first_trade_at': user['first_trade_at'].isoformat() if user['first_trade_at'] else None,
+            'last_trade_at': user['last_trade_at'].isoformat() if user['last_trade_at'] else None
+        }
+
+    return Plan(f"account-{user['user_id']}-{user['trade_count']}-{snapshot.version}",
+                (ACCOUNT_SQL, (user['user_id'],)), build)
+
+# Trade history, newest first. Pages are keyed by the last trade_id seen
+# (?before=<trade_id>) rather than an offset, so each page is one index
+# range scan however deep the client pages.
+def _history(user, snapshot, args, market_view):
+    limit = _page_size(args)
+    before = args.get('before', type=int)
+    if before is None:
+        query = (HISTORY_SQL, (user['user_id'], limit + 1))
+    else:
+        query = (HISTORY_BEFORE_SQL, (user['user_id'], before, user['user_id'], limit + 1))
+
+    def build(rows):
+        trades = [_format_trade(row) for row in rows[:limit]]
+        return {
+            'trades': trades,
+            'next': trades[-1]['trade_id'] if len(rows) > limit else None
+        }
+
+    return Plan(f"history-{user['user_id']}-{user['trade_count']}-{before}-{limit}", query, build)
+
+# A symbol's recent ticks for sparklines, from this process's ring buffer
+def _ticks(user, snapshot, args, market_view, symbol):
+    if snapshot.get(symbol) is None:
+        return {'error': 'Unknown symbol'}, 404
+
+    def build(rows):
+        return {'symbol': symbol, 'version': snapshot.version, 'ticks': recent_ticks(symbol, snapshot)}
+
+    return Plan(f'ticks-{symbol}-{snapshot.version}', None, build)
+
+# A symbol's OHLC bars (?resolution=1m|1h&limit=N), oldest first. The
+# current bar changes on every tick, so they share the tick's ETag.
+def _bars(user, snapshot, args, market_view, symbol):
+    resolution = args.get('resolution', BAR_RESOLUTIONS[0])
+    if snapshot.get(symbol) is None or resolution not in BAR_RESOLUTIONS:
+        return {'error': 'Unknown symbol or resolution'}, 404
+    limit = max(1, min(args.get('limit', BAR_COUNT, type=int), MAX_BAR_COUNT))
+
+    def build(rows):
+        return {'symbol': symbol, 'resolution': resolution, 'bars': bars_from_rows(rows)}
+
+    return Plan(f'bars-{symbol}-{resolution}-{limit}-{snapshot.version}',
+                (BARS_SQL, (symbol, resolution, limit)), build)
+
+# (URL rule, endpoint, whether it needs the user, plan)
+ENDPOINTS = [
+    ('/api/market', 'api_market', False, _market),
+    ('/api/positions', 'api_positions', True, _positions),
+    ('/api/account', 'api_account', True, _account),
+    ('/api/history', 'api_history', True, _history),
+    ('/api/ticks/<symbol>', 'api_ticks', False, _ticks),
+    ('/api/bars/<symbol>', 'api_bars', False, _bars)
+]
+
+# Answer with a plan: 304 Not Modified if the client already holds its
+# ETag, otherwise its JSON body, built from its query run on the request's
+# connection
+def respond(plan):
+    if not isinstance(plan, Plan):
+        body, status = plan
+        return jsonify(body), status
+
+    if is_fresh(request, plan.etag):
+        response = Response(status=304)
+    else:
+        rows = None
+        if plan.query is not None:
+            cur = get_db_connection().cursor()
+            cur.execute(*plan.query)
+            rows = cur.fetchall()
+            cur.close()
+        response = jsonify(plan.build(rows))
+    return tag_response(response, plan.etag)
+
+def _view(plan, needs_user, load_user, market_view):
+    def view(**kwargs):
+        user = load_user() if needs_user else None
+        return respond(plan(user, get_snapshot(), request.args, market_view, **kwargs))
+    return view
+
+# Register the JSON endpoints used to refresh parts of the dashboard on a
+# platform's blueprint (or an app).
+# load_user returns the request's user (see user_context.load_user) and
+# market_view returns the platform's (market_data list, symbol -> stock).
+def init_app(app, load_user, market_view):
+    for rule, endpoint, needs_user, plan in ENDPOINTS:
+        app.add_url_rule(rule, endpoint, _view(plan, needs_user, load_user, market_view))
@@ -0,0 +1,123 @@
+from flask import g, has_app_context
+from contextlib import contextmanager
+from psycopg.pq import TransactionStatus
+from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
+import os
+import time
+import threading
+from dotenv import load_dotenv
+from instrumentation import InstrumentedCursor, record_acquire, register_collector
+
+load_dotenv()
+
+# Pool settings (per process - each gunicorn worker gets its own pool)
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800))
+POOL_MAX_IDLE = float(os.environ.get('DB_POOL_MAX_IDLE', 600))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+# Get the connection pool for this process, creating it on first use.
+# The pool is created lazily and re-created after a fork so that workers
+# never share sockets inherited from the gunicorn master.
+def get_pool():
+    global _pool, _pool_pid
+
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool(
+                os.environ.get('DATABASE_URL'),
+                min_size=POOL_MIN_SIZE,
+                max_size=POOL_MAX_SIZE,
+                timeout=POOL_TIMEOUT,
+                max_lifetime=POOL_MAX_LIFETIME,
+                max_idle=POOL_MAX_IDLE,
+                kwargs={'row_factory': dict_row, 'cursor_factory': InstrumentedCursor},
+                check=ConnectionPool.check_connection,
+                name=f"trading-{os.getpid()}",
+                open=True
+            )
+            _pool_pid = os.getpid()
+
+    return _pool
+
+# Database connection
+# Borrows one connection from the pool per app/request context and hands the
+# same connection back on every later call, so a request never holds more
+# than one. The connection is returned to the pool in release_db_connection().
+def get_db_connection():
+    if 'db_conn' not in g:
+        started = time.perf_counter()
+        g.db_conn = get_pool().getconn()
+        record_acquire(time.perf_counter() - started)
+    return g.db_conn
+
+# Return the request's connection to the pool
+def release_db_connection(exception=None):
+    conn = g.pop('db_conn', None)
+    if conn is None:
+        return
+
+    try:
+        # Don't hand a connection with an open transaction back to the pool
+        if not conn.closed and conn.info.transaction_status != TransactionStatus.IDLE:
+            conn.rollback()
+    except Exception as e:
+        print(f"Error resetting connection: {e}")
+    finally:
+        get_pool().putconn(conn)
+
+# Context manager for code that may run inside or outside a request.
+# Inside a request it reuses the request's connection; elsewhere (background
+# threads, CLI) it borrows a pooled connection for the duration of the block.
+@contextmanager
+def db_connection():
+    if has_app_context():
+        yield get_db_connection()
+    else:
+        with get_pool().connection() as conn:
+            yield conn
+
+# Close the pool (used on shutdown)
+def close_pool():
+    global _pool, _pool_pid
+
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.close()
+        _pool = None
+        _pool_pid = None
+
+# Pool gauges and counters for /metrics
+def _collect_pool_metrics():
+    if _pool is None or _pool_pid != os.getpid():
+        return []
+
+    stats = _pool.get_stats()
+    return [
+        ('trading_db_pool_size', 'gauge', 'Connections currently managed by the pool.',
+         [({}, stats.get('pool_size', 0))]),
+        ('trading_db_pool_available', 'gauge', 'Idle connections in the pool.',
+         [({}, stats.get('pool_available', 0))]),
+        ('trading_db_pool_requests_waiting', 'gauge', 'Requests waiting for a connection.',
+         [({}, stats.get('requests_waiting', 0))]),
+        ('trading_db_pool_requests_total', 'counter', 'Connections requested from the pool.',
+         [({}, stats.get('requests_num', 0))]),
+        ('trading_db_pool_timeouts_total', 'counter', 'Requests that timed out waiting for a connection.',
+         [({}, stats.get('requests_errors', 0))]),
+        ('trading_db_pool_connections_total', 'counter', 'Connections opened by the pool.',
+         [({}, stats.get('connections_num', 0))])
+    ]
+
+# Register the pool with a Flask app
+def init_app(app):
+    app.teardown_appcontext(release_db_connection)
+    register_collector(_collect_pool_metrics)
@@ -0,0 +1,52 @@
+import os
+import numpy as np
+
+# How orders are priced: buys fill at the ask and sells at the bid, each
+# half a spread away from the last price. The spread widens with a
+# symbol's volatility class, and larger orders can optionally pay
+# slippage on top.
+
+# Half-spread as a fraction of the last price, for each volatility class
+HALF_SPREADS = {
+    'high': 0.0005,    # 0.05%
+    'medium': 0.0002,  # 0.02%
+    'low': 0.0001      # 0.01%
+}
+# Extra price impact, as a fraction of price, per 1,000 shares ordered.
+# 0 disables slippage.
+SLIPPAGE_PER_1000 = float(os.environ.get('FILL_SLIPPAGE_PER_1000', 0))
+# Cap on the slippage any one order pays
+MAX_SLIPPAGE = float(os.environ.get('FILL_MAX_SLIPPAGE', 0.01))
+
+def half_spread(volatility):
+    return HALF_SPREADS.get(volatility, HALF_SPREADS['low'])
+
+def _slippage(shares):
+    return np.minimum(SLIPPAGE_PER_1000 * np.asarray(shares, dtype=np.float64) / 1000, MAX_SLIPPAGE)
+
+# Round buyers' prices up and sellers' down to the cent (sides +1 buy, -1
+# sell), so a half-spread under half a cent still leaves the bid below the
+# last price and the ask above it. The tolerance keeps float error in a
+# price that is already whole cents from costing a cent.
+def _to_cents(prices, sides):
+    cents = np.asarray(prices, dtype=np.float64) * 100
+    return np.where(np.asarray(sides) > 0, np.ceil(cents - 1e-6), np.floor(cents + 1e-6)) / 100
+
+# Bid and ask for a quote (see market_cache.make_quote)
+def bid_ask(quote):
+    spread = quote['price'] * half_spread(quote['volatility'])
+    return float(_to_cents(quote['price'] - spread, -1)), float(_to_cents(quote['price'] + spread, 1))
+
+# Fill prices for a batch of orders in one vectorised pass. All arguments
+# are aligned arrays: last prices, half-spreads (see half_spread()),
+# sides (+1 buy, -1 sell) and share counts.
+def fill_prices(prices, half_spreads, sides, shares):
+    prices = np.asarray(prices, dtype=np.float64)
+    impact = np.asarray(half_spreads, dtype=np.float64) + _slippage(shares)
+    return _to_cents(prices * (1 + np.asarray(sides) * impact), sides)
+
+# Fill price for one order against a quote
+def fill_price(quote, action, shares):
+    side = 1 if action == 'buy' else -1
+    impact = half_spread(quote['volatility']) + float(_slippage(shares))
+    return float(_to_cents(quote['price'] * (1 + side * impact), side))
@@ -0,0 +1,193 @@
+from flask import Blueprint, render_template, request, jsonify, session
+import random
+from market_cache import get_snapshot
+from user_context import load_user, load_user_state
+from portfolio import value_portfolio
+from leaderboard import get_top, get_rank
+from achievements import list_achievements, on_signup, on_trade
+from price_stream import stream_response
+from dashboard_api import init_app as init_dashboard_api
+from core import (TRADE_ERRORS, failure, server_error, page_error, log_event,
+                  execute_market_order, bind_platform)
+
+# The gamified platform: leaderboard, achievements and one-click trades
+bp = Blueprint('gamified', __name__)
+
+@bp.before_request
+def _bind_platform():
+    return bind_platform('gamified')
+
+# Initialize session and user
+def init_user():
+    user = load_user('gamified')
+    if user['created']:
+        # New users start with the badges their starting account earns
+        on_signup(user)
+    return user
+
+# Format the market snapshot for the gamified market table.
+# Built once per price tick and shared by all requests until the next one.
+def _format_market_data(snapshot):
+    market_data = []
+    for quote in snapshot.sorted_quotes:
+        market_data.append({
+            'symbol': quote['symbol'],
+            'name': quote['name'],
+            'price': quote['price'],
+            'change': quote['change'],
+            'percent': quote['percent'],
+            'volume': f"{random.randint(10, 250)}M"
+        })
+    
+    return market_data, {stock['symbol']: stock for stock in market_data}
+
+# Get current stock prices.
+# Returns (market_data list, symbol -> stock mapping).
+def get_market_data():
+    return get_snapshot().view('gamified', _format_market_data)
+
+# JSON endpoints for refreshing parts of the dashboard without a page load
+init_dashboard_api(bp, init_user, get_market_data)
+
+# Template variables for the dashboard, from the user, the market snapshot,
+# the user's state (see user_context.load_user_state()) and the
+# leaderboard and badge lookups
+def index_context(user, snapshot, state, top, ranking, achievements):
+    user_id = user['user_id']
+    current_cash = user['current_cash']
+    
+    # Calculate portfolio value
+    market_data, _ = snapshot.view('gamified', _format_market_data)
+    valuation = value_portfolio(state.positions, snapshot, current_cash)
+    portfolio_value = valuation.total_value
+    
+    user_stats = {
+        'rank': ranking['rank'] if ranking else None,
+        'total_users': top['total_users'],
+        'streak': user['streak_days'],
+        'badges': sum(badge['unlocked'] for badge in achievements),
+        'portfolio_value': portfolio_value,
+        'cash': current_cash,
+        'daily_change': portfolio_value - 100000.00,
+        'daily_change_percent': ((portfolio_value - 100000.00) / 100000.00 * 100),
+        'level': 'Beginner',
+        'xp': 0,
+        'next_level_xp': 1000,
+        'trade_count': user['trade_count'],
+        'realized_pnl': user['realized_pnl']
+    }
+    
+    # Top 10 leaderboard only
+    leaderboard = []
+    for entry in top['entries']:
+        leaderboard.append(dict(entry, name='You' if entry['user_id'] == user_id else f"Trader #{entry['user_id']}"))
+    
+    # Format trade history
+    formatted_history = []
+    for trade in state.history[:10]:
+        formatted_history.append({
+            'symbol': trade['symbol'],
+            'action': trade['action'],
+            'shares': trade['shares'],
+            'price': float(trade['price']),
+            'total': float(trade['total_cost']),
+            'timestamp': trade['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
+        })
+    
+    return {
+        'user_stats': user_stats,
+        'leaderboard': leaderboard,
+        'market_data': market_data,
+        'achievements': achievements,
+        'portfolio': valuation.rows(),
+        'trade_history': formatted_history
+    }
+
+@bp.route('/')
+def index():
+    try:
+        user = init_user()
+        
+        # IMPORTANT: Only log events AFTER user is fully initialized
+        log_event('page_view', {'page': 'home'})
+        
+        # Everything but the market and leaderboard comes from the user's
+        # cached state; the rank is re-read once per leaderboard refresh
+        state = load_user_state(user)
+        top = get_top()
+        ranking = state.memo('rank', top['version'], lambda: get_rank(user['user_id']))
+        
+        context = index_context(user, get_snapshot(), state, top, ranking, list_achievements(user))
+        return render_template('gamified.html', **context)
+        
+    except Exception as e:
+        return page_error('Index', e)
+
+# The trade in a one-click trade request's JSON body (also its
+# trade_attempt event), or None if it has none.
+# Raises ValueError if shares isn't a whole number.
+def parse_trade(data):
+    if not data:
+        return None
+    return {
+        'symbol': data.get('symbol'),
+        'shares': int(data.get('shares', 0)),
+        'action': data.get('action')
+    }
+
+# Reply refusing a trade that can't be executed, or None
+def check_trade(order):
+    if order['shares'] <= 0:
+        return failure('Invalid number of shares')
+    if not order['symbol']:
+        return failure(TRADE_ERRORS['unknown_symbol'])
+    return None
+
+# Reply to an executed trade, with any badges it unlocked
+def trade_reply(order, result, unlocked):
+    if not result['success']:
+        return failure(TRADE_ERRORS[result['reason']])
+
+    verb = 'bought' if order['action'] == 'buy' else 'sold'
+    response = {
+        'success': True,
+        'message': f"Successfully {verb} {order['shares']} shares of {order['symbol']}!",
+        'cash': result['cash'],
+        'position': result['position'],
+        'trade': result['trade']
+    }
+    
+    if unlocked:
+        response['achievement_unlocked'] = unlocked[0]
+        response['achievements_unlocked'] = unlocked
+    
+    return response
+
+@bp.route('/trade', methods=['POST'])
+def trade():
+    try:
+        # Ensure user is initialized
+        if 'session_id' not in session or 'user_id' not in session:
+            init_user()
+        
+        order = parse_trade(request.json)
+        if order is None:
+            return jsonify(failure('No data received'))
+        
+        log_event('trade_attempt', order)
+        
+        refusal = check_trade(order)
+        if refusal:
+            return jsonify(refusal)
+        
+        result = execute_market_order(order['symbol'], order['action'], order['shares'])
+        unlocked = on_trade(result) if result['success'] else []
+        return jsonify(trade_reply(order, result, unlocked))
+        
+    except Exception as e:
+        return jsonify(server_error('Trade', e))
+
+# Live prices and account changes as Server-Sent Events
+@bp.route('/stream')
+def stream():
+    return stream_response(init_user())
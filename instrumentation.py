@@ -0,0 +1,288 @@
+from flask import g, request, has_app_context, Response
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+import psycopg
+
+# Log one structured line per request (set REQUEST_LOG=0 to disable)
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') == '1'
+# Upper bounds (seconds) of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+logger = logging.getLogger('trading.requests')
+
+# Cursor that times every statement and records it against the current
+# request. Installed as the cursor factory on every pooled connection.
+class InstrumentedCursor(psycopg.Cursor):
+    def execute(self, query, params=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            record_statement(query, time.perf_counter() - started)
+
+    def executemany(self, query, params_seq, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, params_seq, **kwargs)
+        finally:
+            record_statement(query, time.perf_counter() - started)
+
+    def copy(self, statement, params=None, **kwargs):
+        record_statement(statement, 0.0)
+        return super().copy(statement, params, **kwargs)
+
+# InstrumentedCursor for the async pool (async_db.py)
+class InstrumentedAsyncCursor(psycopg.AsyncCursor):
+    async def execute(self, query, params=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            record_statement(query, time.perf_counter() - started)
+
+    async def executemany(self, query, params_seq, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().executemany(query, params_seq, **kwargs)
+        finally:
+            record_statement(query, time.perf_counter() - started)
+
+    def copy(self, statement, params=None, **kwargs):
+        record_statement(statement, 0.0)
+        return super().copy(statement, params, **kwargs)
+
+# Stats of the ASGI request being served (see start_async_request()).
+# Quart's request context isn't Flask's, so they are kept in a context
+# variable, which also follows the request into the tasks it gathers and
+# onto the worker threads it starts with asyncio.to_thread().
+_async_stats = contextvars.ContextVar('db_stats', default=None)
+
+# The current request's stats, or None outside a request
+def _request_stats():
+    if has_app_context() and 'db_stats' in g:
+        return g.db_stats
+    return _async_stats.get()
+
+def _statement_text(query):
+    if not isinstance(query, str):
+        query = repr(query)
+    return ' '.join(query.split())[:200]
+
+# Record one statement. Inside a request it is added to the request's stats;
+# every statement also counts towards the process totals.
+def record_statement(query, seconds):
+    stats = _request_stats()
+    _metrics.add_statement(seconds, in_request=stats is not None)
+
+    if stats is None:
+        return
+
+    stats['count'] += 1
+    stats['time'] += seconds
+    if seconds >= stats['slowest_time']:
+        stats['slowest_time'] = seconds
+        stats['slowest_query'] = _statement_text(query)
+
+# Record how long the request waited for a pooled connection
+def record_acquire(seconds):
+    stats = _request_stats()
+    if stats is not None:
+        stats['acquire_time'] += seconds
+
+# Process-wide counters exposed on /metrics
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.background_statements = 0
+        self.background_db_time = 0.0
+        self.collectors = []
+
+    def add_statement(self, seconds, in_request):
+        if in_request:
+            return
+        with self._lock:
+            self.background_statements += 1
+            self.background_db_time += seconds
+
+    def add_request(self, method, endpoint, status, duration, stats):
+        key = (method, endpoint, str(status))
+        with self._lock:
+            entry = self.requests.get(key)
+            if entry is None:
+                entry = self.requests[key] = {
+                    'count': 0,
+                    'duration': 0.0,
+                    'buckets': [0] * len(DURATION_BUCKETS),
+                    'db_statements': 0,
+                    'db_time': 0.0,
+                    'db_acquire_time': 0.0
+                }
+            entry['count'] += 1
+            entry['duration'] += duration
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    entry['buckets'][i] += 1
+            entry['db_statements'] += stats['count']
+            entry['db_time'] += stats['time']
+            entry['db_acquire_time'] += stats['acquire_time']
+
+    # Render everything in the Prometheus text exposition format
+    def render(self):
+        lines = []
+
+        def family(name, metric_type, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        with self._lock:
+            requests = {key: dict(entry, buckets=list(entry['buckets'])) for key, entry in self.requests.items()}
+            background_statements = self.background_statements
+            background_db_time = self.background_db_time
+            collectors = list(self.collectors)
+
+        def labels(key):
+            method, endpoint, status = key
+            return f'method="{method}",endpoint="{endpoint}",status="{status}"'
+
+        family('trading_http_requests_total', 'counter', 'HTTP requests handled.')
+        for key, entry in requests.items():
+            lines.append(f"trading_http_requests_total{{{labels(key)}}} {entry['count']}")
+
+        family('trading_http_request_duration_seconds', 'histogram', 'HTTP request duration.')
+        for key, entry in requests.items():
+            for bound, count in zip(DURATION_BUCKETS, entry['buckets']):
+                lines.append(f"trading_http_request_duration_seconds_bucket{{{labels(key)},le=\"{bound}\"}} {count}")
+            lines.append(f"trading_http_request_duration_seconds_bucket{{{labels(key)},le=\"+Inf\"}} {entry['count']}")
+            lines.append(f"trading_http_request_duration_seconds_sum{{{labels(key)}}} {entry['duration']:.6f}")
+            lines.append(f"trading_http_request_duration_seconds_count{{{labels(key)}}} {entry['count']}")
+
+        family('trading_db_statements_total', 'counter', 'SQL statements executed by request handlers.')
+        for key, entry in requests.items():
+            lines.append(f"trading_db_statements_total{{{labels(key)}}} {entry['db_statements']}")
+
+        family('trading_db_time_seconds_total', 'counter', 'Time spent executing SQL in request handlers.')
+        for key, entry in requests.items():
+            lines.append(f"trading_db_time_seconds_total{{{labels(key)}}} {entry['db_time']:.6f}")
+
+        family('trading_db_acquire_seconds_total', 'counter', 'Time request handlers waited for a pooled connection.')
+        for key, entry in requests.items():
+            lines.append(f"trading_db_acquire_seconds_total{{{labels(key)}}} {entry['db_acquire_time']:.6f}")
+
+        family('trading_db_background_statements_total', 'counter', 'SQL statements executed outside requests.')
+        lines.append(f"trading_db_background_statements_total {background_statements}")
+        family('trading_db_background_time_seconds_total', 'counter', 'Time spent executing SQL outside requests.')
+        lines.append(f"trading_db_background_time_seconds_total {background_db_time:.6f}")
+
+        for collect in collectors:
+            try:
+                for name, metric_type, help_text, samples in collect():
+                    family(name, metric_type, help_text)
+                    for sample_labels, value in samples:
+                        label_text = ','.join(f'{k}="{v}"' for k, v in sample_labels.items())
+                        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+
+        return '\n'.join(lines) + '\n'
+
+_metrics = Metrics()
+
+# Register an extra source of metrics for /metrics. The collector is called
+# on every scrape and returns (name, type, help, [(labels dict, value), ...]).
+def register_collector(collect):
+    with _metrics._lock:
+        if collect not in _metrics.collectors:
+            _metrics.collectors.append(collect)
+
+def _new_stats():
+    return {
+        'count': 0,
+        'time': 0.0,
+        'acquire_time': 0.0,
+        'slowest_time': 0.0,
+        'slowest_query': None
+    }
+
+# Start timing a request. g is the framework's request globals (Flask's or
+# Quart's). Returns the request's stats.
+def start_request(g):
+    g.request_started = time.perf_counter()
+    g.db_stats = _new_stats()
+    return g.db_stats
+
+# start_request() for the ASGI app, whose statements find the stats through
+# a context variable rather than Flask's g
+def start_async_request(g):
+    _async_stats.set(start_request(g))
+
+# Finish timing a request started by start_request()
+def finish_request(g, request, response):
+    if 'db_stats' in g:
+        record_request(request, response, time.perf_counter() - g.request_started, g.db_stats)
+    return response
+
+def _start_request():
+    start_request(g)
+
+def _finish_request(response):
+    return finish_request(g, request, response)
+
+# Add a finished request's Server-Timing header, metrics and log line.
+# request and response are Flask's or, for the ASGI app, Quart's.
+def record_request(request, response, duration, stats):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+
+    response.headers['Server-Timing'] = ', '.join([
+        f'db;dur={stats["time"] * 1000:.2f};desc="{stats["count"]} queries"',
+        f'db-acquire;dur={stats["acquire_time"] * 1000:.2f}',
+        f'db-slowest;dur={stats["slowest_time"] * 1000:.2f}',
+        f'app;dur={duration * 1000:.2f}'
+    ])
+
+    if endpoint != '/metrics':
+        _metrics.add_request(request.method, endpoint, response.status_code, duration, stats)
+
+    if REQUEST_LOG and endpoint != '/metrics':
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'db_queries': stats['count'],
+            'db_time_ms': round(stats['time'] * 1000, 2),
+            'db_acquire_ms': round(stats['acquire_time'] * 1000, 2),
+            'slowest_query_ms': round(stats['slowest_time'] * 1000, 2),
+            'slowest_query': stats['slowest_query']
+        }))
+
+METRICS_MIMETYPE = 'text/plain; version=0.0.4'
+
+def metrics():
+    return Response(render_metrics(), mimetype=METRICS_MIMETYPE)
+
+# The /metrics page, in the Prometheus text format
+def render_metrics():
+    return _metrics.render()
+
+# Send the request log lines to stderr, one JSON object per line
+def init_request_log():
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+# Register request instrumentation and the /metrics endpoint with a Flask app.
+# Call this before the other init_app() hooks so their queries are counted.
+def init_app(app):
+    init_request_log()
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -0,0 +1,217 @@
+import os
+import time
+import threading
+import numpy as np
+from db import db_connection
+from async_db import fetch_one
+from portfolio import value_portfolios
+from price_engine import register_tick_handler
+
+# Number of traders shown on the leaderboard
+TOP_N = 10
+# Maximum age in seconds of this process's cached top-N before re-reading it
+MAX_STALENESS = float(os.environ.get('LEADERBOARD_MAX_STALENESS', 1.0))
+
+BADGES = {1: '🏆', 2: '🥈', 3: '🥉'}
+
+# The arm whose users are ranked; traditional users never see the
+# leaderboard and are kept out of it, so they don't shift the gamified
+# arm's ranks, totals and rank badges
+PLATFORM = 'gamified'
+
+# Ranks every gamified user by return on their starting cash, from cash plus
+# positions marked to market, and materialises the ranking in the
+# leaderboard table. Runs on the price engine leader after each tick: one
+# vectorised valuation of all portfolios, then only rows whose rank or
+# value moved are written. Between ticks a trade only moves a user's total
+# value by the spread it pays, which the next refresh picks up.
+class LeaderboardRefresher:
+    def __init__(self):
+        self.latest = None
+        self._version = None
+        self._user_ids = np.empty(0, dtype=np.int64)
+        self._ranks = np.empty(0, dtype=np.int64)
+        self._values = np.empty(0, dtype=np.float64)
+
+    def refresh(self, conn, snapshot):
+        # If ticks were missed another process may have written the table
+        # since, so rewrite every row rather than trust the last refresh
+        rewrite = self._version is None or snapshot.version != self._version + 1
+        if rewrite:
+            self._user_ids = np.empty(0, dtype=np.int64)
+
+        with conn.transaction():
+            cur = conn.cursor()
+            cur.execute('''
+                SELECT user_id, current_cash, initial_cash
+                FROM users
+                WHERE platform_type = %s
+            ''', (PLATFORM,))
+            users = cur.fetchall()
+            cur.execute('''
+                SELECT p.user_id, p.symbol, p.shares, p.avg_price
+                FROM portfolio p
+                JOIN users u ON u.user_id = p.user_id
+                WHERE u.platform_type = %s
+            ''', (PLATFORM,))
+            positions = cur.fetchall()
+
+            cash = {row['user_id']: float(row['current_cash']) for row in users}
+            initial = {row['user_id']: float(row['initial_cash']) for row in users}
+            valuation = value_portfolios(positions, snapshot, cash)
+            user_ids = valuation.user_ids
+            values = np.round(valuation.total_value, 2)
+            initial_cash = np.array([initial.get(int(user_id), 0.0) for user_id in user_ids])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                returns = np.where(initial_cash > 0, (values - initial_cash) / initial_cash * 100, 0.0)
+
+            # Best return first; ties go to the earlier user
+            order = np.lexsort((user_ids, -returns))
+            ranks = np.empty(len(user_ids), dtype=np.int64)
+            ranks[order] = np.arange(1, len(user_ids) + 1)
+
+            if rewrite:
+                # Rows left by users no longer ranked
+                cur.execute('DELETE FROM leaderboard WHERE user_id <> ALL(%s)', (user_ids.tolist(),))
+
+            changed = self._changed(user_ids, ranks, values)
+            if changed.any():
+                cur.execute('''
+                    INSERT INTO leaderboard (user_id, rank, total_value, return_percent)
+                    SELECT * FROM unnest(%s::int[], %s::int[], %s::numeric[], %s::float8[])
+                    ON CONFLICT (user_id) DO UPDATE
+                    SET rank = EXCLUDED.rank,
+                        total_value = EXCLUDED.total_value,
+                        return_percent = EXCLUDED.return_percent
+                ''', (
+                    user_ids[changed].tolist(),
+                    ranks[changed].tolist(),
+                    values[changed].tolist(),
+                    returns[changed].tolist()
+                ))
+            cur.execute('''
+                UPDATE leaderboard_state
+                SET tick_version = %s, total_users = %s, refreshed_at = CURRENT_TIMESTAMP
+                WHERE id = 1
+            ''', (snapshot.version, len(user_ids)))
+            cur.close()
+
+        self._user_ids, self._ranks, self._values = user_ids, ranks, values
+        self._version = snapshot.version
+        self.latest = {
+            'version': snapshot.version,
+            'user_ids': user_ids,
+            'ranks': ranks,
+            'total_values': values,
+            'returns': returns
+        }
+
+    # Rows that are new or whose rank or value differs from the last refresh.
+    # Both id arrays are sorted, so old rows are matched with a binary search.
+    def _changed(self, user_ids, ranks, values):
+        if len(self._user_ids) == 0:
+            return np.ones(len(user_ids), dtype=bool)
+        at = np.minimum(np.searchsorted(self._user_ids, user_ids), len(self._user_ids) - 1)
+        known = self._user_ids[at] == user_ids
+        return ~known | (self._ranks[at] != ranks) | (self._values[at] != values)
+
+_refresher = LeaderboardRefresher()
+
+def _refresh_on_tick(conn, snapshot):
+    _refresher.refresh(conn, snapshot)
+
+# The ranking computed by this process's last refresh, or None if this
+# process isn't the engine leader. A dict of version plus arrays aligned
+# with user_ids: ranks, total_values and returns (percent).
+def latest_ranking():
+    return _refresher.latest
+
+# This process's copy of the top of the leaderboard
+_top = None
+_top_lock = threading.Lock()
+
+def _load_top(cur, limit):
+    cur.execute('''
+        SELECT s.tick_version, s.total_users,
+               l.user_id, l.rank, l.total_value, l.return_percent, u.trade_count
+        FROM leaderboard_state s
+        LEFT JOIN LATERAL (
+            SELECT * FROM leaderboard ORDER BY rank LIMIT %s
+        ) l ON TRUE
+        LEFT JOIN users u ON u.user_id = l.user_id
+        WHERE s.id = 1
+        ORDER BY l.rank
+    ''', (limit,))
+    rows = cur.fetchall()
+    version = rows[0]['tick_version'] if rows else 0
+    total_users = rows[0]['total_users'] if rows else 0
+    entries = tuple(
+        {
+            'user_id': row['user_id'],
+            'rank': row['rank'],
+            'total_value': float(row['total_value']),
+            'returns': round(row['return_percent'], 1),
+            'trade_count': row['trade_count'],
+            'badge': BADGES.get(row['rank'], '⭐')
+        }
+        for row in rows if row['user_id'] is not None
+    )
+    return {'version': version, 'total_users': total_users, 'entries': entries, 'loaded_at': time.monotonic()}
+
+# Get the leaderboard's top entries and total number of ranked users.
+# Shared by all requests in the process and re-read at most once per
+# MAX_STALENESS, so a page view normally costs no query.
+# Returns a dict with version, total_users and entries (rank, user_id,
+# total_value, returns, trade_count, badge).
+def get_top():
+    global _top
+
+    top = _top
+    if top is not None and time.monotonic() - top['loaded_at'] < MAX_STALENESS:
+        return top
+
+    if not _top_lock.acquire(blocking=top is None):
+        return top
+    try:
+        if _top is top:
+            with db_connection() as conn:
+                cur = conn.cursor()
+                _top = _load_top(cur, TOP_N)
+                cur.close()
+        return _top
+    finally:
+        _top_lock.release()
+
+RANK_SQL = '''
+    SELECT rank, total_value, return_percent
+    FROM leaderboard
+    WHERE user_id = %s
+'''
+
+def _rank_from_row(row):
+    if row is None:
+        return None
+    return {
+        'rank': row['rank'],
+        'total_value': float(row['total_value']),
+        'returns': row['return_percent']
+    }
+
+# Get one user's rank and return, or None if they haven't been ranked yet
+# (new users are picked up on the next tick). A primary key lookup.
+def get_rank(user_id):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(RANK_SQL, (user_id,))
+        row = cur.fetchone()
+        cur.close()
+    return _rank_from_row(row)
+
+# get_rank() for the ASGI app, on its own async pooled connection
+async def get_rank_async(user_id):
+    return _rank_from_row(await fetch_one(RANK_SQL, (user_id,)))
+
+# Keep the leaderboard refreshed by this app's price engine. Both apps
+# register it: whichever process wins the engine leader lock maintains it.
+def init_app(app):
+    register_tick_handler(_refresh_on_tick)
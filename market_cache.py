@@ -0,0 +1,146 @@
+from types import MappingProxyType
+import os
+import time
+import threading
+from db import db_connection
+
+# Maximum age in seconds of a snapshot before the tick version is re-checked
+MAX_STALENESS = float(os.environ.get('MARKET_CACHE_MAX_STALENESS', 1.0))
+
+# Immutable view of the market at one tick version.
+# quotes maps symbol -> quote, sorted_quotes holds the same quotes ordered by
+# symbol. Quotes are read-only mappings with symbol, name, price, base_price,
+# volatility, change and percent.
+class MarketSnapshot:
+    __slots__ = ('version', 'quotes', 'sorted_quotes', 'loaded_at', '_views', '_views_lock')
+
+    def __init__(self, version, quotes):
+        self.version = version
+        self.sorted_quotes = tuple(sorted(quotes, key=lambda q: q['symbol']))
+        self.quotes = MappingProxyType({q['symbol']: q for q in self.sorted_quotes})
+        self.loaded_at = time.monotonic()
+        self._views = {}
+        self._views_lock = threading.Lock()
+
+    def get(self, symbol):
+        return self.quotes.get(symbol)
+
+    # Memoise a derived view (e.g. a platform's formatted market table) for
+    # the lifetime of this snapshot, so it is built once per tick, not per request
+    def view(self, key, builder):
+        try:
+            return self._views[key]
+        except KeyError:
+            pass
+        with self._views_lock:
+            if key not in self._views:
+                self._views[key] = builder(self)
+            return self._views[key]
+
+    # Build the next snapshot from this one with new prices applied
+    def with_prices(self, version, prices):
+        quotes = []
+        for quote in self.sorted_quotes:
+            price = prices.get(quote['symbol'])
+            if price is None:
+                quotes.append(quote)
+            else:
+                quotes.append(make_quote(quote['symbol'], quote['name'], price,
+                                         quote['base_price'], quote['volatility']))
+        return MarketSnapshot(version, quotes)
+
+# Build an immutable quote
+def make_quote(symbol, name, price, base_price, volatility):
+    price = float(price)
+    base_price = float(base_price)
+    change = price - base_price
+    return MappingProxyType({
+        'symbol': symbol,
+        'name': name,
+        'price': price,
+        'base_price': base_price,
+        'volatility': volatility,
+        'change': change,
+        'percent': (change / base_price * 100) if base_price > 0 else 0
+    })
+
+_snapshot = None
+_refresh_lock = threading.Lock()
+
+# Load a full snapshot from the database
+def _load_snapshot(cur):
+    cur.execute('''
+        SELECT s.symbol, s.company_name, s.current_price, s.base_price, s.volatility,
+               m.tick_version
+        FROM stock_prices s
+        CROSS JOIN market_state m
+    ''')
+    rows = cur.fetchall()
+    version = rows[0]['tick_version'] if rows else 0
+    return MarketSnapshot(version, [
+        make_quote(row['symbol'], row['company_name'], row['current_price'],
+                   row['base_price'], row['volatility'])
+        for row in rows
+    ])
+
+# Re-check the tick version and reload the snapshot only if it changed
+def refresh_snapshot():
+    global _snapshot
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        current = _snapshot
+        if current is not None:
+            cur.execute('SELECT tick_version FROM market_state WHERE id = 1')
+            row = cur.fetchone()
+            if row and row['tick_version'] == current.version:
+                current.loaded_at = time.monotonic()
+                cur.close()
+                return current
+        _snapshot = _load_snapshot(cur)
+        cur.close()
+
+    return _snapshot
+
+# Get the current market snapshot. Served from memory while it is younger
+# than MAX_STALENESS; after that one request re-checks the tick version while
+# concurrent requests keep using the previous snapshot.
+def get_snapshot():
+    snapshot = _snapshot
+    if snapshot is not None and time.monotonic() - snapshot.loaded_at < MAX_STALENESS:
+        return snapshot
+
+    if snapshot is None:
+        with _refresh_lock:
+            if _snapshot is None:
+                return refresh_snapshot()
+            return _snapshot
+
+    if not _refresh_lock.acquire(blocking=False):
+        return snapshot
+    try:
+        return refresh_snapshot()
+    finally:
+        _refresh_lock.release()
+
+# Get a snapshot at least as new as the given tick version, reloading it
+# only if this process hasn't seen that tick yet
+def get_snapshot_at(version):
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version >= version:
+        return snapshot
+
+    with _refresh_lock:
+        if _snapshot is not None and _snapshot.version >= version:
+            return _snapshot
+        return refresh_snapshot()
+
+# Publish a tick written by this process's price engine, so the leader's
+# process sees new prices without going back to the database.
+# prices maps symbol -> new price.
+def apply_tick(version, prices):
+    global _snapshot
+
+    with _refresh_lock:
+        if _snapshot is not None and version > _snapshot.version:
+            _snapshot = _snapshot.with_prices(version, prices)
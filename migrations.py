@@ -0,0 +1,516 @@
+from flask.cli import with_appcontext
+import threading
+import click
+from db import db_connection
+from clickstream_partitions import DEFAULT_PARTITION, create_partitions
+
+# Arbitrary key for pg_advisory_xact_lock so only one worker migrates at a time
+MIGRATION_LOCK_KEY = 7305001
+
+# The 20 stocks traded on both platforms
+STOCKS = [
+    ('AAPL', 'Apple Inc.', 178.50, 'medium'),
+    ('MSFT', 'Microsoft Corporation', 378.50, 'medium'),
+    ('GOOGL', 'Alphabet Inc.', 142.00, 'medium'),
+    ('AMZN', 'Amazon.com Inc.', 151.25, 'medium'),
+    ('META', 'Meta Platforms Inc.', 352.75, 'medium'),
+    ('TSLA', 'Tesla Inc.', 242.50, 'high'),
+    ('NVDA', 'NVIDIA Corporation', 478.00, 'high'),
+    ('AMD', 'Advanced Micro Devices', 138.25, 'high'),
+    ('JPM', 'JPMorgan Chase & Co.', 158.75, 'low'),
+    ('BAC', 'Bank of America Corp.', 33.50, 'low'),
+    ('WMT', 'Walmart Inc.', 168.25, 'low'),
+    ('PG', 'Procter & Gamble Co.', 155.50, 'low'),
+    ('JNJ', 'Johnson & Johnson', 157.75, 'low'),
+    ('DIS', 'The Walt Disney Company', 96.50, 'medium'),
+    ('NKE', 'Nike Inc.', 108.75, 'medium'),
+    ('NFLX', 'Netflix Inc.', 442.50, 'high'),
+    ('COST', 'Costco Wholesale Corp.', 588.25, 'low'),
+    ('V', 'Visa Inc.', 258.50, 'low'),
+    ('MA', 'Mastercard Inc.', 412.75, 'low'),
+    ('PEP', 'PepsiCo Inc.', 172.50, 'low')
+]
+
+# Version 1: base tables shared by both platforms
+def _create_base_tables(cur):
+    # Users table
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id SERIAL PRIMARY KEY,
+            session_id VARCHAR(255) UNIQUE NOT NULL,
+            platform_type VARCHAR(50) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            initial_cash DECIMAL(12, 2) DEFAULT 100000.00,
+            current_cash DECIMAL(12, 2) DEFAULT 100000.00
+        )
+    ''')
+
+    # Trades table
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS trades (
+            trade_id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(user_id),
+            session_id VARCHAR(255) NOT NULL,
+            symbol VARCHAR(10) NOT NULL,
+            action VARCHAR(10) NOT NULL,
+            shares INTEGER NOT NULL,
+            price DECIMAL(10, 2) NOT NULL,
+            total_cost DECIMAL(12, 2) NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Portfolio table
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS portfolio (
+            portfolio_id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(user_id),
+            session_id VARCHAR(255) NOT NULL,
+            symbol VARCHAR(10) NOT NULL,
+            shares INTEGER NOT NULL,
+            avg_price DECIMAL(10, 2) NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(session_id, symbol)
+        )
+    ''')
+
+    # Clickstream table for detailed behavioral tracking
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS clickstream (
+            click_id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(user_id),
+            session_id VARCHAR(255) NOT NULL,
+            event_type VARCHAR(50) NOT NULL,
+            event_data JSONB,
+            page_url VARCHAR(255),
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Stock prices table
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS stock_prices (
+            symbol VARCHAR(10) PRIMARY KEY,
+            company_name VARCHAR(100) NOT NULL,
+            base_price DECIMAL(10, 2) NOT NULL,
+            current_price DECIMAL(10, 2) NOT NULL,
+            volatility VARCHAR(10) NOT NULL,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Achievements table
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS achievements (
+            achievement_id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(user_id),
+            session_id VARCHAR(255) NOT NULL,
+            achievement_name VARCHAR(100) NOT NULL,
+            unlocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(session_id, achievement_name)
+        )
+    ''')
+
+# Version 2: seed stock data
+def _seed_stock_data(cur):
+    cur.executemany('''
+        INSERT INTO stock_prices (symbol, company_name, base_price, current_price, volatility)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (symbol) DO NOTHING
+    ''', [(symbol, name, price, price, volatility) for symbol, name, price, volatility in STOCKS])
+
+# Version 3: market tick version, bumped on every price tick so processes
+# can tell whether their cached market snapshot is out of date
+def _create_market_state(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS market_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            tick_version BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cur.execute('INSERT INTO market_state (id) VALUES (1) ON CONFLICT (id) DO NOTHING')
+
+# Version 4: per-user trade statistics, maintained by trade execution so
+# first-trade checks and the dashboard don't have to scan trades
+def _add_user_trade_stats(cur):
+    cur.execute('''
+        ALTER TABLE users
+            ADD COLUMN IF NOT EXISTS trade_count INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS first_trade_at TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS last_trade_at TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS realized_pnl DECIMAL(14, 2) NOT NULL DEFAULT 0
+    ''')
+
+    # Backfill counts and trade times from existing history
+    cur.execute('''
+        UPDATE users u
+        SET trade_count = t.trade_count,
+            first_trade_at = t.first_trade_at,
+            last_trade_at = t.last_trade_at
+        FROM (
+            SELECT session_id, COUNT(*) AS trade_count,
+                   MIN(timestamp) AS first_trade_at, MAX(timestamp) AS last_trade_at
+            FROM trades
+            GROUP BY session_id
+        ) t
+        WHERE u.session_id = t.session_id
+    ''')
+
+    # Realised P&L depends on the average cost at the time of each sell, so
+    # replay the history in order with the same averaging used by trades
+    history = cur.connection.cursor(name='backfill_realized_pnl')
+    history.execute('''
+        SELECT session_id, symbol, action, shares, price
+        FROM trades
+        ORDER BY session_id, timestamp, trade_id
+    ''')
+    positions = {}
+    realized = {}
+    for trade in history:
+        key = (trade['session_id'], trade['symbol'])
+        shares, avg_price = positions.get(key, (0, 0.0))
+        price = float(trade['price'])
+        if trade['action'] == 'BUY':
+            new_shares = shares + trade['shares']
+            avg_price = (shares * avg_price + trade['shares'] * price) / new_shares
+            positions[key] = (new_shares, round(avg_price, 2))
+        else:
+            pnl = (price - avg_price) * trade['shares']
+            realized[trade['session_id']] = realized.get(trade['session_id'], 0.0) + pnl
+            positions[key] = (shares - trade['shares'], avg_price)
+    history.close()
+
+    cur.executemany('''
+        UPDATE users SET realized_pnl = %s WHERE session_id = %s
+    ''', [(round(pnl, 2), session_id) for session_id, pnl in realized.items()])
+
+# Version 5: composite indexes for session-scoped history lookups
+def _add_session_indexes(cur):
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS trades_session_timestamp_idx
+        ON trades (session_id, timestamp DESC)
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS clickstream_session_timestamp_idx
+        ON clickstream (session_id, timestamp)
+    ''')
+
+# Version 6: key child tables by the integer user_id instead of the
+# 255-char session_id. Backfills user_id on existing rows, makes it required
+# where every row has an owner and adds the user_id keys the app queries by.
+# session_id stays on every table for analysis and older tooling.
+def _key_by_user_id(cur):
+    for table in ('trades', 'portfolio', 'clickstream', 'achievements'):
+        cur.execute(f'''
+            UPDATE {table} c
+            SET user_id = u.user_id
+            FROM users u
+            WHERE c.user_id IS NULL AND c.session_id = u.session_id
+        ''')
+
+    # Clickstream may hold events from sessions that never created a user
+    for table in ('trades', 'portfolio', 'achievements'):
+        cur.execute(f'ALTER TABLE {table} ALTER COLUMN user_id SET NOT NULL')
+
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS trades_user_timestamp_idx
+        ON trades (user_id, timestamp DESC)
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS clickstream_user_timestamp_idx
+        ON clickstream (user_id, timestamp)
+    ''')
+    cur.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS portfolio_user_symbol_key
+        ON portfolio (user_id, symbol)
+    ''')
+    cur.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS achievements_user_name_key
+        ON achievements (user_id, achievement_name)
+    ''')
+
+# Version 7: materialised leaderboard, rewritten by the price engine leader
+# after each tick so rank lookups and top-N are index scans
+def _create_leaderboard(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard (
+            user_id INTEGER PRIMARY KEY REFERENCES users(user_id),
+            rank INTEGER NOT NULL,
+            total_value DECIMAL(14, 2) NOT NULL,
+            return_percent DOUBLE PRECISION NOT NULL
+        )
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS leaderboard_rank_idx ON leaderboard (rank)')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            tick_version BIGINT NOT NULL DEFAULT 0,
+            total_users INTEGER NOT NULL DEFAULT 0,
+            refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cur.execute('INSERT INTO leaderboard_state (id) VALUES (1) ON CONFLICT (id) DO NOTHING')
+
+# Version 8: per-user stats the achievement rules are evaluated against,
+# plus a counter bumped whenever badges are unlocked so cached unlocked
+# sets can be validated from the user row. Streaks are backfilled from
+# trade history.
+def _add_achievement_stats(cur):
+    cur.execute('''
+        ALTER TABLE users
+            ADD COLUMN IF NOT EXISTS day_trade_count INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS streak_days INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS green_days INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS green_day DATE,
+            ADD COLUMN IF NOT EXISTS achievements_version INTEGER NOT NULL DEFAULT 0
+    ''')
+
+    # Trades on the day of each user's last trade
+    cur.execute('''
+        UPDATE users u
+        SET day_trade_count = t.trades
+        FROM (
+            SELECT t.user_id, count(*) AS trades
+            FROM trades t
+            JOIN users u ON u.user_id = t.user_id
+            WHERE t.timestamp::date = u.last_trade_at::date
+            GROUP BY t.user_id
+        ) t
+        WHERE u.user_id = t.user_id
+    ''')
+
+    # Length of the run of consecutive trading days ending on the last one
+    cur.execute('''
+        WITH days AS (
+            SELECT DISTINCT user_id, timestamp::date AS day FROM trades
+        ),
+        runs AS (
+            SELECT user_id, day,
+                   day - (row_number() OVER (PARTITION BY user_id ORDER BY day))::int AS run
+            FROM days
+        ),
+        last_run AS (
+            SELECT DISTINCT ON (user_id) user_id, run
+            FROM runs
+            ORDER BY user_id, day DESC
+        )
+        UPDATE users u
+        SET streak_days = (
+            SELECT count(*) FROM runs r
+            WHERE r.user_id = l.user_id AND r.run = l.run
+        )
+        FROM last_run l
+        WHERE u.user_id = l.user_id
+    ''')
+
+# Version 9: resting limit and stop orders. Open orders are held in the
+# price engine's in-memory book; the partial index serves both loading the
+# book and listing a user's open orders.
+def _create_orders(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS orders (
+            order_id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(user_id),
+            session_id VARCHAR(255) NOT NULL,
+            symbol VARCHAR(10) NOT NULL,
+            action VARCHAR(4) NOT NULL,
+            order_type VARCHAR(10) NOT NULL,
+            shares INTEGER NOT NULL CHECK (shares > 0),
+            limit_price DECIMAL(10, 2),
+            stop_price DECIMAL(10, 2),
+            time_in_force VARCHAR(3) NOT NULL DEFAULT 'day',
+            status VARCHAR(10) NOT NULL DEFAULT 'open',
+            reason VARCHAR(50),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            triggered_at TIMESTAMP,
+            closed_at TIMESTAMP,
+            fill_price DECIMAL(10, 2),
+            trade_id INTEGER REFERENCES trades(trade_id)
+        )
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS orders_open_user_idx
+        ON orders (user_id, created_at DESC) WHERE status = 'open'
+    ''')
+
+# Version 10: every tick's prices, plus OHLC bars rolled up from them as
+# each tick is written (resolution '1m' or '1h', bucket = start of the bar)
+def _create_price_history(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS price_ticks (
+            tick_version BIGINT NOT NULL,
+            symbol VARCHAR(10) NOT NULL,
+            price DECIMAL(10, 2) NOT NULL,
+            recorded_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (tick_version, symbol)
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS price_bars (
+            symbol VARCHAR(10) NOT NULL,
+            resolution VARCHAR(3) NOT NULL,
+            bucket TIMESTAMP NOT NULL,
+            open DECIMAL(10, 2) NOT NULL,
+            high DECIMAL(10, 2) NOT NULL,
+            low DECIMAL(10, 2) NOT NULL,
+            close DECIMAL(10, 2) NOT NULL,
+            ticks INTEGER NOT NULL,
+            PRIMARY KEY (symbol, resolution, bucket)
+        )
+    ''')
+
+# Version 11: a per-user version bumped by every change to what the user's
+# dashboard shows, so processes can cache it (see user_state.py)
+def _add_user_state_version(cur):
+    cur.execute('''
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS state_version BIGINT NOT NULL DEFAULT 0
+    ''')
+
+# Version 12: clickstream range partitioned on timestamp, so old events can
+# be retired a partition at a time and time-range queries skip the
+# partitions outside the range (see clickstream_partitions.py). Events are
+# copied into the new table through its default partition, then moved into
+# partitions covering them and the days ahead. The primary key has to
+# include the partition key, and a BRIN index on timestamp serves range
+# scans within a partition for next to nothing on insert.
+def _partition_clickstream(cur):
+    cur.execute('ALTER TABLE clickstream RENAME TO clickstream_unpartitioned')
+    cur.execute('ALTER INDEX clickstream_pkey RENAME TO clickstream_unpartitioned_pkey')
+    cur.execute('ALTER SEQUENCE clickstream_click_id_seq OWNED BY NONE')
+    cur.execute('''
+        CREATE TABLE clickstream (
+            click_id INTEGER NOT NULL DEFAULT nextval('clickstream_click_id_seq'),
+            user_id INTEGER REFERENCES users(user_id),
+            session_id VARCHAR(255) NOT NULL,
+            event_type VARCHAR(50) NOT NULL,
+            event_data JSONB,
+            page_url VARCHAR(255),
+            timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (click_id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    ''')
+    cur.execute('ALTER SEQUENCE clickstream_click_id_seq OWNED BY clickstream.click_id')
+    cur.execute(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF clickstream DEFAULT')
+
+    # Events without a time are kept as of the migration
+    cur.execute('''
+        INSERT INTO clickstream (click_id, user_id, session_id, event_type, event_data, page_url, timestamp)
+        SELECT click_id, user_id, session_id, event_type, event_data, page_url,
+               COALESCE(timestamp, LOCALTIMESTAMP)
+        FROM clickstream_unpartitioned
+    ''')
+    cur.execute('DROP TABLE clickstream_unpartitioned')
+
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS clickstream_session_timestamp_idx
+        ON clickstream (session_id, timestamp)
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS clickstream_user_timestamp_idx
+        ON clickstream (user_id, timestamp)
+    ''')
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS clickstream_timestamp_brin
+        ON clickstream USING BRIN (timestamp)
+    ''')
+
+    # On the database's clock, which stamps the events
+    cur.execute('SELECT LOCALTIMESTAMP AS now')
+    create_partitions(cur, cur.fetchone()['now'])
+
+# Version 13: BRIN index for reading trades by time range, as the analytics
+# export does on every run (see analytics_export.py). Trades are appended in
+# time order, so it stays a few pages and costs next to nothing on insert.
+def _add_trades_time_index(cur):
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS trades_timestamp_brin
+        ON trades USING BRIN (timestamp)
+    ''')
+
+# Ordered list of (version, description, apply function).
+# Append new migrations to the end - never edit or reorder applied ones.
+MIGRATIONS = [
+    (1, 'base tables', _create_base_tables),
+    (2, 'seed stock data', _seed_stock_data),
+    (3, 'market tick version', _create_market_state),
+    (4, 'user trade stats', _add_user_trade_stats),
+    (5, 'session history indexes', _add_session_indexes),
+    (6, 'user_id keys for child tables', _key_by_user_id),
+    (7, 'leaderboard', _create_leaderboard),
+    (8, 'achievement stats', _add_achievement_stats),
+    (9, 'limit and stop orders', _create_orders),
+    (10, 'price history', _create_price_history),
+    (11, 'user state version', _add_user_state_version),
+    (12, 'partitioned clickstream', _partition_clickstream),
+    (13, 'trades time index', _add_trades_time_index),
+]
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+# Get the highest applied schema version
+def get_schema_version(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cur.execute('SELECT COALESCE(MAX(version), 0) AS version FROM schema_version')
+    return cur.fetchone()['version']
+
+# Apply all pending migrations, each in its own transaction.
+# Returns the list of versions applied.
+def run_migrations():
+    with db_connection() as conn:
+        cur = conn.cursor()
+        applied = []
+
+        for version, description, apply in MIGRATIONS:
+            # Serialise concurrent workers; the lock is released on commit
+            cur.execute('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK_KEY,))
+            if version <= get_schema_version(cur):
+                conn.commit()
+                continue
+
+            print(f"Applying migration {version}: {description}")
+            apply(cur)
+            cur.execute('''
+                INSERT INTO schema_version (version, description)
+                VALUES (%s, %s)
+            ''', (version, description))
+            conn.commit()
+            applied.append(version)
+
+        cur.close()
+    return applied
+
+# Make sure the schema is up to date. After the first successful call this
+# only checks an in-process flag, so it is cheap enough for the request path.
+def ensure_schema():
+    global _schema_ready
+
+    if _schema_ready:
+        return
+
+    with _schema_lock:
+        if not _schema_ready:
+            run_migrations()
+            _schema_ready = True
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create tables and seed data, applying any pending migrations."""
+    applied = run_migrations()
+    if applied:
+        click.echo(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+    else:
+        click.echo('Schema is up to date.')
+
+# Register the bootstrap step and CLI command with a Flask app
+def init_app(app):
+    app.cli.add_command(init_db_command)
+    app.before_request(ensure_schema)
@@ -0,0 +1,367 @@
+import json
+import heapq
+from db import db_connection
+from async_db import fetch_all
+from fill_model import fill_price, fill_prices, half_spread
+from price_engine import register_tick_handler
+from trading import execute_trade, fill_orders
+from user_state import touch_users
+
+# NOTIFY channel carrying new and cancelled orders to the price engine
+# leader, which keeps its book in step without re-reading the table
+ORDERS_CHANNEL = 'order_events'
+
+ORDER_TYPES = ('limit', 'stop', 'stop-limit')
+# 'day' orders expire at the end of the database's day they were placed.
+# 'fok' orders never rest: they fill in full at once or not at all. There
+# is no immediate-or-cancel: fills aren't limited by size, so there is
+# never a partial fill for one to take.
+TIME_IN_FORCE = ('day', 'gtc', 'fok')
+
+# Where an order rests: its trigger price and whether it fires when the
+# price falls to it. Buy limits and sell stops fire on a fall, sell limits
+# and buy stops on a rise. A stop-limit rests on its stop until triggered,
+# then on its limit.
+def _trigger(order):
+    if order['order_type'] == 'limit' or order['triggered']:
+        return order['limit_price'], order['action'] == 'buy'
+    return order['stop_price'], order['action'] == 'sell'
+
+def _reached(order, price):
+    trigger, falling = _trigger(order)
+    return price <= trigger if falling else price >= trigger
+
+# Whether a fill price honours the order's limit, if it has one
+def _within_limit(order, fill):
+    if order['order_type'] == 'stop':
+        return True
+    if order['action'] == 'buy':
+        return fill <= order['limit_price']
+    return fill >= order['limit_price']
+
+def _book_order(row):
+    return {
+        'order_id': row['order_id'],
+        'user_id': row['user_id'],
+        'session_id': row['session_id'],
+        'symbol': row['symbol'],
+        'action': row['action'].lower(),
+        'order_type': row['order_type'],
+        'shares': row['shares'],
+        'limit_price': float(row['limit_price']) if row['limit_price'] is not None else None,
+        'stop_price': float(row['stop_price']) if row['stop_price'] is not None else None,
+        'triggered': row['triggered']
+    }
+
+# Place a limit, stop or stop-limit order against a quote. Triggers are
+# checked against the last price and fills priced by fill_model, so a limit
+# only fills once the bid or ask is within it. An order that can fill now
+# does so as a market order; otherwise it rests until a tick fills it (or
+# fails, for 'fok').
+# Returns a dict with 'success' and either 'reason' or, when it filled now,
+# the execute_trade() result fields, or 'order' for a resting order. Cash
+# and shares are checked when the order fills, not when it is placed.
+def place_order(user, quote, action, order_type, shares,
+                limit_price=None, stop_price=None, time_in_force='day'):
+    symbol = quote['symbol']
+    price = quote['price']
+    if action not in ('buy', 'sell'):
+        return {'success': False, 'reason': 'invalid_action'}
+    if order_type not in ORDER_TYPES:
+        return {'success': False, 'reason': 'invalid_order_type'}
+    if time_in_force not in TIME_IN_FORCE:
+        return {'success': False, 'reason': 'invalid_time_in_force'}
+    if order_type in ('limit', 'stop-limit') and not (limit_price and limit_price > 0):
+        return {'success': False, 'reason': 'invalid_price'}
+    if order_type in ('stop', 'stop-limit') and not (stop_price and stop_price > 0):
+        return {'success': False, 'reason': 'invalid_price'}
+
+    order = {
+        'action': action,
+        'order_type': order_type,
+        'limit_price': round(float(limit_price), 2) if order_type != 'stop' else None,
+        'stop_price': round(float(stop_price), 2) if order_type != 'limit' else None,
+        'triggered': False
+    }
+    if order_type == 'stop-limit' and _reached(order, price):
+        order['triggered'] = True
+    if _reached(order, price):
+        fill = fill_price(quote, action, shares)
+        if _within_limit(order, fill):
+            return execute_trade(user['session_id'], symbol, action, shares, fill)
+    if time_in_force == 'fok':
+        return {'success': False, 'reason': 'not_marketable'}
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            INSERT INTO orders (user_id, session_id, symbol, action, order_type, shares,
+                                limit_price, stop_price, time_in_force, triggered_at)
+            VALUES (%(user_id)s, %(session_id)s, %(symbol)s, %(action)s, %(order_type)s, %(shares)s,
+                    %(limit_price)s, %(stop_price)s, %(time_in_force)s,
+                    CASE WHEN %(triggered)s THEN CURRENT_TIMESTAMP END)
+            RETURNING order_id, created_at, pg_notify(%(channel)s, json_build_object(
+                'status', status, 'order_id', order_id, 'user_id', user_id, 'session_id', session_id,
+                'symbol', symbol, 'action', action, 'order_type', order_type, 'shares', shares,
+                'limit_price', limit_price, 'stop_price', stop_price,
+                'triggered', triggered_at IS NOT NULL)::text)
+        ''', {
+            'user_id': user['user_id'],
+            'session_id': user['session_id'],
+            'symbol': symbol,
+            'action': action.upper(),
+            'order_type': order_type,
+            'shares': shares,
+            'limit_price': order['limit_price'],
+            'stop_price': order['stop_price'],
+            'time_in_force': time_in_force,
+            'triggered': order['triggered'],
+            'channel': ORDERS_CHANNEL
+        })
+        row = cur.fetchone()
+        touch_users(cur, [user['user_id']])
+        conn.commit()
+        cur.close()
+
+    return {
+        'success': True,
+        'order': {
+            'order_id': row['order_id'],
+            'symbol': symbol,
+            'side': action.upper(),
+            'order_type': order_type,
+            'shares': shares,
+            'limit_price': order['limit_price'],
+            'stop_price': order['stop_price'],
+            'time_in_force': time_in_force,
+            'created_at': row['created_at'].strftime('%Y-%m-%d %H:%M:%S')
+        }
+    }
+
+# Cancel one of a user's open orders. Returns False if it isn't open.
+def cancel_order(user_id, order_id):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            UPDATE orders
+            SET status = 'cancelled', closed_at = CURRENT_TIMESTAMP
+            WHERE order_id = %s AND user_id = %s AND status = 'open'
+            RETURNING pg_notify(%s, json_build_object('status', status, 'order_id', order_id)::text)
+        ''', (order_id, user_id, ORDERS_CHANNEL))
+        cancelled = cur.fetchone() is not None
+        if cancelled:
+            touch_users(cur, [user_id])
+        conn.commit()
+        cur.close()
+    return cancelled
+
+OPEN_ORDERS_SQL = '''
+    SELECT order_id, symbol, action, order_type, shares, limit_price, stop_price,
+           time_in_force, created_at, triggered_at
+    FROM orders
+    WHERE user_id = %s AND status = 'open'
+    ORDER BY created_at DESC
+'''
+
+def _open_order(row):
+    return {
+        'order_id': row['order_id'],
+        'symbol': row['symbol'],
+        'side': row['action'],
+        'order_type': row['order_type'],
+        'shares': row['shares'],
+        'limit_price': float(row['limit_price']) if row['limit_price'] is not None else None,
+        'stop_price': float(row['stop_price']) if row['stop_price'] is not None else None,
+        'time_in_force': row['time_in_force'],
+        'triggered': row['triggered_at'] is not None,
+        'created_at': row['created_at'].strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+# A user's open orders, newest first
+def list_open_orders(conn, user_id):
+    cur = conn.cursor()
+    cur.execute(OPEN_ORDERS_SQL, (user_id,))
+    rows = cur.fetchall()
+    cur.close()
+    return [_open_order(row) for row in rows]
+
+# list_open_orders() for the ASGI app, on its own async pooled connection
+async def list_open_orders_async(user_id):
+    return [_open_order(row) for row in await fetch_all(OPEN_ORDERS_SQL, (user_id,))]
+
+# One symbol's resting orders in two heaps keyed by trigger price: orders
+# that fire on a fall (highest trigger on top) and on a rise (lowest on
+# top). Order ids break ties, so equal prices fill oldest first. Finding
+# what a price reaches touches only the orders it fires, O(log n) each.
+class OrderBook:
+    def __init__(self):
+        self._falling = []
+        self._rising = []
+
+    def __len__(self):
+        return len(self._falling) + len(self._rising)
+
+    def add(self, order):
+        trigger, falling = _trigger(order)
+        if falling:
+            heapq.heappush(self._falling, (-trigger, order['order_id'], order))
+        else:
+            heapq.heappush(self._rising, (trigger, order['order_id'], order))
+
+    # Remove and return every order the price reaches
+    def pop_reached(self, price):
+        reached = []
+        while self._falling and -self._falling[0][0] >= price:
+            reached.append(heapq.heappop(self._falling)[2])
+        while self._rising and self._rising[0][0] <= price:
+            reached.append(heapq.heappop(self._rising)[2])
+        return reached
+
+# Matches resting orders against each tick on the price engine leader.
+# The book is loaded once from the orders table, then kept current from
+# ORDERS_CHANNEL notifications on the engine's connection. Cancelled
+# orders are dropped from the id index and skipped when their heap entry
+# surfaces. Everything a tick fills goes out in one transaction.
+class OrderMatcher:
+    def __init__(self):
+        self._conn = None
+        self._day = None
+        self._books = {}
+        self._orders = {}
+
+    def match(self, conn, snapshot):
+        # Rebuild on a new engine connection (its LISTEN is gone) and once a
+        # day, when day orders expire and stale heap entries are dropped. The
+        # day is the database's, which day orders expire by.
+        today = conn.execute('SELECT CURRENT_DATE AS today').fetchone()['today']
+        if conn is not self._conn or today != self._day:
+            self._load(conn, today)
+        else:
+            self._sync(conn)
+
+        reached = []
+        triggered = []
+        for symbol, book in self._books.items():
+            quote = snapshot.get(symbol)
+            if quote is None or not book:
+                continue
+            price = quote['price']
+            for order in book.pop_reached(price):
+                if order['order_id'] not in self._orders:
+                    continue
+                if order['order_type'] == 'stop-limit' and not order['triggered']:
+                    # The stop is hit: it now rests as a limit order
+                    order['triggered'] = True
+                    triggered.append(order['order_id'])
+                    if not _reached(order, price):
+                        book.add(order)
+                        continue
+                reached.append((order, quote))
+
+        # Price every reached order at once; limits the bid or ask doesn't
+        # meet yet go back on the book
+        prices = fill_prices(
+            [quote['price'] for _, quote in reached],
+            [half_spread(quote['volatility']) for _, quote in reached],
+            [1 if order['action'] == 'buy' else -1 for order, _ in reached],
+            [order['shares'] for order, _ in reached]
+        )
+        fills = []
+        for (order, quote), fill in zip(reached, prices.tolist()):
+            if not _within_limit(order, fill):
+                self._books[order['symbol']].add(order)
+                continue
+            del self._orders[order['order_id']]
+            fills.append({
+                'order_id': order['order_id'],
+                'user_id': order['user_id'],
+                'session_id': order['session_id'],
+                'symbol': order['symbol'],
+                'action': order['action'],
+                'shares': order['shares'],
+                'price': fill
+            })
+
+        if not fills and not triggered:
+            return {}
+
+        try:
+            with conn.transaction():
+                cur = conn.cursor()
+                # Owners of orders that changed without a trade (which
+                # bumps its user's state itself)
+                touched = []
+                if triggered:
+                    cur.execute('''
+                        UPDATE orders SET triggered_at = CURRENT_TIMESTAMP
+                        WHERE order_id = ANY(%s) AND status = 'open'
+                        RETURNING user_id
+                    ''', (triggered,))
+                    touched.extend(row['user_id'] for row in cur.fetchall())
+                results = fill_orders(cur, fills)
+                touched.extend(fill['user_id'] for fill in fills if not results[fill['order_id']]['success'])
+                touch_users(cur, touched)
+                cur.close()
+        except Exception:
+            # Popped orders are still open in the table; reload them
+            self._conn = None
+            raise
+        return results
+
+    def _load(self, conn, today):
+        # LISTEN before reading, so no order placed meanwhile is missed
+        conn.execute(f'LISTEN {ORDERS_CHANNEL}')
+        for _ in conn.notifies(timeout=0):
+            pass
+
+        with conn.transaction():
+            cur = conn.cursor()
+            cur.execute('''
+                UPDATE orders
+                SET status = 'expired', closed_at = CURRENT_TIMESTAMP
+                WHERE status = 'open' AND time_in_force = 'day' AND created_at < CURRENT_DATE
+                RETURNING user_id
+            ''')
+            touch_users(cur, [row['user_id'] for row in cur.fetchall()])
+            cur.execute('''
+                SELECT order_id, user_id, session_id, symbol, action, order_type, shares,
+                       limit_price, stop_price, triggered_at IS NOT NULL AS triggered
+                FROM orders
+                WHERE status = 'open'
+            ''')
+            rows = cur.fetchall()
+            cur.close()
+
+        self._books = {}
+        self._orders = {}
+        for row in rows:
+            self._add(_book_order(row))
+        self._conn = conn
+        self._day = today
+
+    def _sync(self, conn):
+        for notify in conn.notifies(timeout=0):
+            if notify.channel != ORDERS_CHANNEL:
+                continue
+            event = json.loads(notify.payload)
+            if event['status'] == 'open':
+                if event['order_id'] not in self._orders:
+                    self._add(_book_order(event))
+            else:
+                self._orders.pop(event['order_id'], None)
+
+    def _add(self, order):
+        self._orders[order['order_id']] = order
+        self._books.setdefault(order['symbol'], OrderBook()).add(order)
+
+_matcher = OrderMatcher()
+
+def _match_on_tick(conn, snapshot):
+    for order_id, result in _matcher.match(conn, snapshot).items():
+        if not result['success']:
+            print(f"Order {order_id} rejected: {result['reason']}")
+
+# Match resting orders on this app's price engine. Both apps register it:
+# whichever process wins the engine leader lock runs the book.
+def init_app(app):
+    register_tick_handler(_match_on_tick)
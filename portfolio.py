@@ -0,0 +1,198 @@
+from collections.abc import Mapping
+import numpy as np
+from async_db import fetch_all
+
+# Portfolio valuation. Positions are turned into aligned arrays (shares,
+# average cost, current price) and valued in one vectorised pass, for one
+# user or for any number of users at once.
+
+ACCOUNT_SQL = '''
+    SELECT u.current_cash, p.symbol, p.shares, p.avg_price
+    FROM users u
+    LEFT JOIN portfolio p ON p.user_id = u.user_id
+    WHERE u.user_id = %s
+'''
+
+def account_from_rows(rows):
+    cash = float(rows[0]['current_cash']) if rows else 0.0
+    positions = {
+        row['symbol']: {'shares': row['shares'], 'avg_price': float(row['avg_price'])}
+        for row in rows if row['symbol'] is not None
+    }
+    return cash, positions
+
+# Load a user's cash and positions (symbol -> shares, avg_price)
+def load_account(conn, user_id):
+    cur = conn.cursor()
+    cur.execute(ACCOUNT_SQL, (user_id,))
+    rows = cur.fetchall()
+    cur.close()
+    return account_from_rows(rows)
+
+# load_account() for the ASGI app, on its own async pooled connection
+async def load_account_async(user_id):
+    return account_from_rows(await fetch_all(ACCOUNT_SQL, (user_id,)))
+
+# Load every user's positions and cash for batch valuation.
+# Returns (positions rows with user_id, symbol, shares, avg_price,
+# user_id -> cash). Pass user_ids to restrict it to some users.
+def load_portfolios(conn, user_ids=None):
+    cur = conn.cursor()
+    if user_ids is None:
+        cur.execute('SELECT user_id, current_cash FROM users')
+        cash = {row['user_id']: float(row['current_cash']) for row in cur.fetchall()}
+        cur.execute('SELECT user_id, symbol, shares, avg_price FROM portfolio')
+    else:
+        user_ids = list(user_ids)
+        cur.execute('SELECT user_id, current_cash FROM users WHERE user_id = ANY(%s)', (user_ids,))
+        cash = {row['user_id']: float(row['current_cash']) for row in cur.fetchall()}
+        cur.execute('''
+            SELECT user_id, symbol, shares, avg_price FROM portfolio WHERE user_id = ANY(%s)
+        ''', (user_ids,))
+    rows = cur.fetchall()
+    cur.close()
+    return rows, cash
+
+# Symbol -> index and the matching array of prices for a snapshot.
+# Built once per tick and shared by every valuation against that snapshot.
+def price_vector(snapshot):
+    return snapshot.view('price_vector', _build_price_vector)
+
+def _build_price_vector(snapshot):
+    index = {quote['symbol']: i for i, quote in enumerate(snapshot.sorted_quotes)}
+    prices = np.array([quote['price'] for quote in snapshot.sorted_quotes], dtype=np.float64)
+    return index, prices
+
+# Current price for each position. Symbols that are no longer quoted are
+# held at cost.
+def _current_prices(symbols, avg_price, snapshot):
+    index, prices = price_vector(snapshot)
+    if len(prices) == 0:
+        return avg_price.copy()
+    positions = np.fromiter((index.get(symbol, -1) for symbol in symbols),
+                            dtype=np.intp, count=len(symbols))
+    return np.where(positions >= 0, prices[positions], avg_price)
+
+def _gain_loss_percent(gain_loss, cost_basis):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(cost_basis > 0, gain_loss / cost_basis * 100, 0.0)
+
+# One user's portfolio valued at a snapshot's prices.
+# Per-position arrays are aligned with symbols; weights are each position's
+# share of the total account value (cash included).
+class Valuation:
+    def __init__(self, symbols, shares, avg_price, price, cash=0.0):
+        self.symbols = symbols
+        self.shares = shares
+        self.avg_price = avg_price
+        self.price = price
+        self.cash = cash
+
+        self.market_value = shares * price
+        self.cost_basis = shares * avg_price
+        self.gain_loss = self.market_value - self.cost_basis
+        self.gain_loss_percent = _gain_loss_percent(self.gain_loss, self.cost_basis)
+
+        self.positions_value = float(self.market_value.sum())
+        self.unrealized_pnl = float(self.gain_loss.sum())
+        self.total_value = cash + self.positions_value
+        if self.total_value > 0:
+            self.weights = self.market_value / self.total_value
+        else:
+            self.weights = np.zeros_like(self.market_value)
+
+    # Positions as dicts (plain Python numbers), optionally only some symbols
+    def rows(self, only=None):
+        columns = zip(
+            self.symbols,
+            self.shares.tolist(),
+            self.avg_price.tolist(),
+            self.price.tolist(),
+            self.market_value.tolist(),
+            self.gain_loss.tolist(),
+            self.gain_loss_percent.tolist(),
+            self.weights.tolist()
+        )
+        return [
+            {
+                'symbol': symbol,
+                'shares': int(shares),
+                'avg_price': avg_price,
+                'current_price': price,
+                'market_value': market_value,
+                'gain_loss': gain_loss,
+                'gain_loss_percent': gain_loss_percent,
+                'weight': weight
+            }
+            for symbol, shares, avg_price, price, market_value, gain_loss, gain_loss_percent, weight in columns
+            if only is None or symbol in only
+        ]
+
+# Value one user's positions at the snapshot's prices. positions is either
+# a mapping of symbol -> {'shares', 'avg_price'} or rows with symbol,
+# shares and avg_price (e.g. straight from the portfolio table).
+def value_portfolio(positions, snapshot, cash=0.0):
+    if isinstance(positions, Mapping):
+        items = [(symbol, p['shares'], p['avg_price']) for symbol, p in positions.items()]
+    else:
+        items = [(row['symbol'], row['shares'], row['avg_price']) for row in positions]
+
+    symbols = [symbol for symbol, _, _ in items]
+    shares = np.array([shares for _, shares, _ in items], dtype=np.float64)
+    avg_price = np.array([float(avg_price) for _, _, avg_price in items], dtype=np.float64)
+    price = _current_prices(symbols, avg_price, snapshot)
+    return Valuation(symbols, shares, avg_price, price, cash)
+
+# Many users' portfolios valued at once. Per-user totals are aligned with
+# user_ids (sorted); per-position arrays are aligned with the input rows,
+# and owner maps each row to its user's index.
+class BatchValuation:
+    def __init__(self, user_ids, owner, symbols, shares, avg_price, price, cash):
+        self.user_ids = user_ids
+        self.owner = owner
+        self.symbols = symbols
+        self.shares = shares
+        self.avg_price = avg_price
+        self.price = price
+        self.cash = cash
+
+        self.market_value = shares * price
+        self.cost_basis = shares * avg_price
+        self.gain_loss = self.market_value - self.cost_basis
+        self.gain_loss_percent = _gain_loss_percent(self.gain_loss, self.cost_basis)
+
+        users = len(user_ids)
+        self.positions_value = np.bincount(owner, weights=self.market_value, minlength=users)
+        self.cost_basis_total = np.bincount(owner, weights=self.cost_basis, minlength=users)
+        self.unrealized_pnl = self.positions_value - self.cost_basis_total
+        self.total_value = cash + self.positions_value
+
+        account_value = self.total_value[owner]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.weights = np.where(account_value > 0, self.market_value / account_value, 0.0)
+
+    # Position of a user in user_ids, or None
+    def index_of(self, user_id):
+        i = np.searchsorted(self.user_ids, user_id)
+        if i < len(self.user_ids) and self.user_ids[i] == user_id:
+            return int(i)
+        return None
+
+# Value many users' positions in one pass. rows have user_id, symbol,
+# shares and avg_price; cash maps user_id -> cash. Users with cash but no
+# positions are included.
+def value_portfolios(rows, snapshot, cash=None):
+    cash = cash or {}
+    row_users = np.fromiter((row['user_id'] for row in rows), dtype=np.int64, count=len(rows))
+    user_ids, owner = np.unique(
+        np.concatenate([row_users, np.fromiter(cash.keys(), dtype=np.int64, count=len(cash))]),
+        return_inverse=True
+    )
+    owner = owner[:len(rows)]
+
+    symbols = [row['symbol'] for row in rows]
+    shares = np.fromiter((row['shares'] for row in rows), dtype=np.float64, count=len(rows))
+    avg_price = np.fromiter((float(row['avg_price']) for row in rows), dtype=np.float64, count=len(rows))
+    price = _current_prices(symbols, avg_price, snapshot)
+    user_cash = np.array([cash.get(int(user_id), 0.0) for user_id in user_ids], dtype=np.float64)
+    return BatchValuation(user_ids, owner, symbols, shares, avg_price, price, user_cash)
@@ -0,0 +1,284 @@
+from flask.cli import with_appcontext
+from psycopg.rows import dict_row
+import psycopg
+from market_cache import apply_tick, get_snapshot_at
+from price_history import record_ticks
+from price_models import create_model
+from instrumentation import InstrumentedCursor
+from db import db_connection
+import os
+import time
+import atexit
+import threading
+import click
+import numpy as np
+
+# Seconds between price ticks
+TICK_INTERVAL = float(os.environ.get('PRICE_TICK_INTERVAL', 5))
+# Set to 0 to stop web workers from running the ticker (e.g. when it runs
+# as a standalone process via 'flask run-price-engine')
+ENGINE_ENABLED = os.environ.get('PRICE_ENGINE_ENABLED', '1') == '1'
+# Arbitrary key for the session-level advisory lock that elects the leader
+LEADER_LOCK_KEY = 7305002
+# NOTIFY channel announcing each new tick version to every process
+TICK_CHANNEL = 'market_ticks'
+
+# Floor for a walking price
+MIN_PRICE = 0.01
+
+# Move every stock one tick with the price model, walking from each
+# stock's current price ('price') rather than its base price. The walk
+# keeps full precision, so moves under a cent still add up; only the
+# prices written out are rounded to the cent.
+# Returns (list of (symbol, new_price) tuples, array of unrounded prices).
+def generate_prices(stocks, model):
+    current = np.array([stock['price'] for stock in stocks], dtype=np.float64)
+    walked = np.maximum(model.step(current), MIN_PRICE)
+    rounded = np.maximum(np.round(walked, 2), MIN_PRICE)
+    return list(zip([stock['symbol'] for stock in stocks], rounded.tolist())), walked
+
+# Write all new prices and bump the market tick version in a single statement,
+# notifying listeners of the new version when it commits. The same statement
+# appends the prices to price_ticks and folds them into the 1-minute and
+# 1-hour OHLC bars, so history costs no extra round trip and the bars are
+# always current.
+# Returns (new tick version, tick timestamp).
+def write_prices(cur, prices):
+    cur.execute('''
+        WITH moved AS (
+            UPDATE stock_prices AS s
+            SET current_price = v.price, last_updated = CURRENT_TIMESTAMP
+            FROM unnest(%(symbols)s::varchar[], %(prices)s::numeric[]) AS v(symbol, price)
+            WHERE s.symbol = v.symbol
+        ),
+        ticked AS (
+            UPDATE market_state
+            SET tick_version = tick_version + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = 1
+            RETURNING tick_version, updated_at
+        ),
+        recorded AS (
+            INSERT INTO price_ticks (tick_version, symbol, price, recorded_at)
+            SELECT t.tick_version, v.symbol, v.price, t.updated_at
+            FROM ticked t
+            CROSS JOIN unnest(%(symbols)s::varchar[], %(prices)s::numeric[]) AS v(symbol, price)
+        ),
+        bars AS (
+            INSERT INTO price_bars AS b (symbol, resolution, bucket, open, high, low, close, ticks)
+            SELECT v.symbol, r.resolution, date_trunc(r.unit, t.updated_at),
+                   v.price, v.price, v.price, v.price, 1
+            FROM ticked t
+            CROSS JOIN unnest(%(symbols)s::varchar[], %(prices)s::numeric[]) AS v(symbol, price)
+            CROSS JOIN (VALUES ('1m', 'minute'), ('1h', 'hour')) AS r(resolution, unit)
+            ON CONFLICT (symbol, resolution, bucket) DO UPDATE
+            SET high = GREATEST(b.high, EXCLUDED.high),
+                low = LEAST(b.low, EXCLUDED.low),
+                close = EXCLUDED.close,
+                ticks = b.ticks + 1
+        )
+        SELECT tick_version, updated_at, pg_notify(%(channel)s, tick_version::text)
+        FROM ticked
+    ''', {
+        'symbols': [symbol for symbol, _ in prices],
+        'prices': [price for _, price in prices],
+        'channel': TICK_CHANNEL
+    })
+    row = cur.fetchone()
+    return row['tick_version'], row['updated_at']
+
+# Background scheduler that moves stock prices on a fixed interval.
+# Every process may run one, but only the holder of the leader advisory lock
+# writes prices; the others keep trying to take over in case the leader dies.
+class PriceEngine:
+    def __init__(self, interval=TICK_INTERVAL):
+        self.interval = interval
+        self._conn = None
+        self._is_leader = False
+        self._stocks = None
+        self._model = None
+        self._model_symbols = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def is_leader(self):
+        return self._is_leader
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='price-engine', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+        self._close_connection()
+
+    # Run one tick: move every symbol and write them in one statement
+    def tick(self):
+        conn = self._get_connection()
+        with conn.transaction():
+            cur = conn.cursor()
+            # Only the leader moves prices, so it reads them once when it
+            # takes over and walks them in memory from then on
+            if self._stocks is None:
+                # In symbol order, so a seeded model draws the same moves
+                # for each symbol as simulate-prices does
+                cur.execute('SELECT symbol, current_price, volatility FROM stock_prices ORDER BY symbol')
+                self._stocks = [
+                    {'symbol': row['symbol'], 'price': float(row['current_price']),
+                     'volatility': row['volatility']}
+                    for row in cur.fetchall()
+                ]
+                # The model, and its seeded generator, lasts as long as the
+                # engine: retaking the lead carries on its stream of moves
+                # rather than replaying it. A leader in another process
+                # starts its own stream from the seed.
+                symbols = [stock['symbol'] for stock in self._stocks]
+                if self._model is None or symbols != self._model_symbols:
+                    self._model = create_model((stock['volatility'] for stock in self._stocks), self.interval)
+                    self._model_symbols = symbols
+            prices, walked = generate_prices(self._stocks, self._model)
+            version, recorded_at = write_prices(cur, prices)
+            cur.close()
+        for stock, price in zip(self._stocks, walked.tolist()):
+            stock['price'] = price
+        apply_tick(version, dict(prices))
+        record_ticks(version, recorded_at, prices)
+
+        snapshot = get_snapshot_at(version)
+        for handler in list(_tick_handlers):
+            try:
+                handler(conn, snapshot)
+            except Exception as e:
+                print(f"Tick handler error ({handler.__name__}): {e}")
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                if not self._is_leader:
+                    self._is_leader = self._try_acquire_leadership()
+                if self._is_leader:
+                    self.tick()
+            except Exception as e:
+                print(f"Price engine error: {e}")
+                # A broken connection also drops the advisory lock
+                self._close_connection()
+
+            # Keep a fixed cadence regardless of how long the tick took
+            next_tick += self.interval
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                next_tick = time.monotonic()
+                delay = 0
+            self._stop.wait(delay)
+
+    def _try_acquire_leadership(self):
+        cur = self._get_connection().cursor()
+        cur.execute('SELECT pg_try_advisory_lock(%s) AS acquired', (LEADER_LOCK_KEY,))
+        acquired = cur.fetchone()['acquired']
+        cur.close()
+        if acquired:
+            print(f"Price engine leader elected (pid {os.getpid()})")
+            # Another leader may have moved prices since this one last led
+            self._stocks = None
+        return acquired
+
+    # The leader lock is tied to a session, so the engine keeps its own
+    # dedicated connection instead of borrowing one from the request pool
+    def _get_connection(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg.connect(
+                os.environ.get('DATABASE_URL'),
+                row_factory=dict_row,
+                cursor_factory=InstrumentedCursor,
+                autocommit=True
+            )
+        return self._conn
+
+    def _close_connection(self):
+        self._is_leader = False
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+_tick_handlers = []
+
+# Register work to run on the leader after every committed tick.
+# handler(conn, snapshot) gets the engine's autocommit connection and the
+# snapshot for the new prices; a failing handler doesn't affect the others.
+def register_tick_handler(handler):
+    if handler not in _tick_handlers:
+        _tick_handlers.append(handler)
+
+_engine = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+
+# Get this process's price engine
+def get_engine():
+    global _engine, _engine_pid
+
+    with _engine_lock:
+        if _engine is None or _engine_pid != os.getpid():
+            _engine = PriceEngine()
+            _engine_pid = os.getpid()
+            atexit.register(_engine.stop)
+
+    return _engine
+
+# Start the price engine for this process if it isn't running yet.
+# Called lazily from the request path so the thread is started after
+# gunicorn forks its workers, not in the master.
+def ensure_engine_started():
+    if ENGINE_ENABLED:
+        get_engine().start()
+
+@click.command('run-price-engine')
+@with_appcontext
+def run_price_engine_command():
+    """Run the price ticker as a standalone process."""
+    engine = get_engine()
+    engine.start()
+    click.echo(f"Price engine running every {engine.interval}s (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        engine.stop()
+
+@click.command('simulate-prices')
+@click.option('--ticks', default=720, help='Number of ticks, PRICE_TICK_INTERVAL apart, to simulate.')
+@click.option('--model', default=None, help='Price model (default: PRICE_MODEL).')
+@click.option('--seed', default=None, type=int, help='Generator seed, for a repeatable session.')
+@click.option('--output', type=click.File('w'), default='-', help='CSV file to write (default: stdout).')
+@with_appcontext
+def simulate_prices_command(ticks, model, seed, output):
+    """Simulate a session of prices from the current ones, as CSV."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT symbol, current_price, volatility FROM stock_prices ORDER BY symbol')
+        stocks = cur.fetchall()
+        cur.close()
+
+    price_model = create_model([stock['volatility'] for stock in stocks], TICK_INTERVAL,
+                               name=model, seed=seed)
+    paths = price_model.simulate([float(stock['current_price']) for stock in stocks], ticks)
+    paths = np.maximum(np.round(paths, 2), MIN_PRICE)
+
+    output.write('tick,' + ','.join(stock['symbol'] for stock in stocks) + '\n')
+    for tick, row in enumerate(paths.tolist(), start=1):
+        output.write(f"{tick}," + ','.join(f'{price:.2f}' for price in row) + '\n')
+
+# Register the price engine with a Flask app
+def init_app(app):
+    app.cli.add_command(run_price_engine_command)
+    app.cli.add_command(simulate_prices_command)
+    app.before_request(ensure_engine_started)
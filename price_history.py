@@ -0,0 +1,104 @@
+from collections import deque
+import os
+import threading
+from db import db_connection
+
+# Ticks kept in memory per symbol (an hour at the default 5 second interval)
+RING_SIZE = int(os.environ.get('TICK_HISTORY_SIZE', 720))
+# OHLC bar resolutions rolled up by the price engine (see write_prices)
+BAR_RESOLUTIONS = ('1m', '1h')
+
+# Per-process ring buffer of each symbol's most recent ticks, so charts and
+# sparklines are served from memory. The engine leader appends every tick
+# it writes; any other process catches up from price_ticks, with a single
+# range scan on tick_version, the first time it is asked for a newer tick.
+class TickHistory:
+    def __init__(self, size=RING_SIZE):
+        self.size = size
+        self.version = 0
+        self._ticks = {}
+        self._lock = threading.Lock()
+
+    # Append the next tick. One that doesn't follow on from the last is
+    # left for sync() to load with whatever was missed before it.
+    def append(self, version, recorded_at, prices):
+        with self._lock:
+            if version != self.version + 1:
+                return
+            for symbol, price in prices:
+                self._ring(symbol).append((version, recorded_at, float(price)))
+            self.version = version
+
+    # Load every tick after the last one held, up to version
+    def sync(self, version):
+        with self._lock:
+            if version <= self.version:
+                return
+            since = max(self.version, version - self.size)
+            with db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute('''
+                    SELECT tick_version, symbol, price, recorded_at
+                    FROM price_ticks
+                    WHERE tick_version > %s AND tick_version <= %s
+                    ORDER BY tick_version
+                ''', (since, version))
+                rows = cur.fetchall()
+                cur.close()
+
+            if since > self.version:
+                # Too far behind: everything held is older than the window
+                self._ticks = {}
+            for row in rows:
+                self._ring(row['symbol']).append(
+                    (row['tick_version'], row['recorded_at'], float(row['price'])))
+            self.version = version
+
+    # A symbol's ticks, oldest first, as (version, recorded_at, price)
+    def recent(self, symbol, version):
+        self.sync(version)
+        with self._lock:
+            return list(self._ticks.get(symbol, ()))
+
+    def _ring(self, symbol):
+        ring = self._ticks.get(symbol)
+        if ring is None:
+            ring = self._ticks[symbol] = deque(maxlen=self.size)
+        return ring
+
+_history = TickHistory()
+
+# Called by the price engine with each tick it commits.
+# prices is a list of (symbol, price).
+def record_ticks(version, recorded_at, prices):
+    _history.append(version, recorded_at, prices)
+
+# A symbol's recent ticks up to a snapshot's version, oldest first
+def recent_ticks(symbol, snapshot):
+    return [
+        {'version': version, 'time': recorded_at.isoformat(), 'price': price}
+        for version, recorded_at, price in _history.recent(symbol, snapshot.version)
+    ]
+
+# A symbol's latest OHLC bars at a resolution, newest first
+BARS_SQL = '''
+    SELECT bucket, open, high, low, close, ticks
+    FROM price_bars
+    WHERE symbol = %s AND resolution = %s
+    ORDER BY bucket DESC
+    LIMIT %s
+'''
+
+# BARS_SQL rows as bars for JSON, oldest first
+def bars_from_rows(rows):
+    return [
+        {
+            'time': row['bucket'].isoformat(),
+            'open': float(row['open']),
+            'high': float(row['high']),
+            'low': float(row['low']),
+            'close': float(row['close']),
+            'ticks': row['ticks']
+        }
+        for row in reversed(rows)
+    ]
@@ -0,0 +1,143 @@
+import os
+import numpy as np
+
+# Price models for the price engine. A model turns a vector of current
+# prices (one per symbol) into the next tick's, and can simulate many ticks
+# for every symbol in one vectorised call. Moves are drawn from a seeded
+# NumPy generator, so a given model, seed and symbol set always produce the
+# same session.
+
+# Model used by the price engine (see MODELS)
+PRICE_MODEL = os.environ.get('PRICE_MODEL', 'gbm')
+# Seed for the model's generator; unset draws fresh entropy
+PRICE_MODEL_SEED = os.environ.get('PRICE_MODEL_SEED')
+# Correlation between every pair of symbols' moves (0 for independent)
+PRICE_MODEL_CORRELATION = float(os.environ.get('PRICE_MODEL_CORRELATION', 0))
+# Jumps: expected jumps per symbol per tick, and the mean and standard
+# deviation of each jump's log return. A rate of 0 disables them.
+PRICE_MODEL_JUMP_RATE = float(os.environ.get('PRICE_MODEL_JUMP_RATE', 0))
+PRICE_MODEL_JUMP_MEAN = float(os.environ.get('PRICE_MODEL_JUMP_MEAN', 0))
+PRICE_MODEL_JUMP_STD = float(os.environ.get('PRICE_MODEL_JUMP_STD', 0.05))
+
+# Standard deviation of a day's log return for each volatility class
+# (about 64%, 32% and 16% a year). Models scale it to their tick interval
+# by the square root of time, so how far prices wander in a day doesn't
+# depend on how often they tick.
+DAILY_VOLATILITY = {
+    'high': float(os.environ.get('PRICE_VOLATILITY_HIGH', 0.04)),
+    'medium': float(os.environ.get('PRICE_VOLATILITY_MEDIUM', 0.02)),
+    'low': float(os.environ.get('PRICE_VOLATILITY_LOW', 0.01))
+}
+# The market never closes, so a day is a full one
+SECONDS_PER_DAY = 86400
+
+# Standard deviation of each tick's log return, for symbols of the given
+# volatility classes ticking every interval seconds
+def tick_volatility(volatilities, interval):
+    daily = np.array([DAILY_VOLATILITY.get(volatility, DAILY_VOLATILITY['low']) for volatility in volatilities])
+    return daily * np.sqrt(interval / SECONDS_PER_DAY)
+
+# Base class. Subclasses implement log_returns(); prices move by
+# exp(log return), so a whole path is a cumulative sum.
+class PriceModel:
+    # Ticks drawn at a time by step()
+    block_size = 256
+
+    def __init__(self, rng):
+        self.rng = rng
+        self._block = None
+        self._next = 0
+
+    # Log returns for ticks x symbols, in one draw
+    def log_returns(self, ticks):
+        raise NotImplementedError
+
+    # Price paths for ticks x symbols, starting from prices
+    def simulate(self, prices, ticks):
+        prices = np.asarray(prices, dtype=np.float64)
+        return prices * np.exp(np.cumsum(self.log_returns(ticks), axis=0))
+
+    # The next tick's prices. Returns are drawn block_size ticks at a time.
+    def step(self, prices):
+        if self._block is None or self._next == len(self._block):
+            self._block = self.log_returns(self.block_size)
+            self._next = 0
+        returns = self._block[self._next]
+        self._next += 1
+        return np.asarray(prices, dtype=np.float64) * np.exp(returns)
+
+# Independent uniform moves per tick, as wide as gives the GBM model's
+# spread (a uniform on ±a has standard deviation a/sqrt(3))
+class UniformModel(PriceModel):
+    def __init__(self, volatilities, rng, interval):
+        super().__init__(rng)
+        self.max_moves = tick_volatility(volatilities, interval) * np.sqrt(3)
+
+    def log_returns(self, ticks):
+        moves = self.rng.uniform(-1.0, 1.0, size=(ticks, len(self.max_moves))) * self.max_moves
+        return np.log1p(moves)
+
+# Geometric Brownian motion with per-symbol volatility, optionally
+# correlated across symbols (through the Cholesky factor of the correlation
+# matrix) and with compound Poisson jumps.
+class GBMModel(PriceModel):
+    def __init__(self, volatilities, rng, interval, drift=0.0, correlation=None,
+                 jump_rate=0.0, jump_mean=0.0, jump_std=0.0):
+        super().__init__(rng)
+        self.sigma = tick_volatility(volatilities, interval)
+        self.drift = drift
+        # Raises numpy.linalg.LinAlgError unless the matrix is positive definite
+        self.cholesky = np.linalg.cholesky(correlation) if correlation is not None else None
+        self.jump_rate = jump_rate
+        self.jump_mean = jump_mean
+        self.jump_std = jump_std
+
+    def log_returns(self, ticks):
+        shocks = self.rng.standard_normal((ticks, len(self.sigma)))
+        if self.cholesky is not None:
+            shocks = shocks @ self.cholesky.T
+        returns = (self.drift - self.sigma ** 2 / 2) + self.sigma * shocks
+
+        if self.jump_rate > 0:
+            # The sum of k normal jumps is normal with k times the mean and variance
+            jumps = self.rng.poisson(self.jump_rate, size=returns.shape)
+            sizes = self.rng.standard_normal(returns.shape)
+            returns += jumps * self.jump_mean + np.sqrt(jumps) * self.jump_std * sizes
+        return returns
+
+# Correlation matrix with the same correlation between every pair of symbols
+def uniform_correlation(symbols, correlation):
+    matrix = np.full((symbols, symbols), correlation)
+    np.fill_diagonal(matrix, 1.0)
+    return matrix
+
+def _gbm_from_env(volatilities, rng, interval):
+    correlation = None
+    if PRICE_MODEL_CORRELATION:
+        correlation = uniform_correlation(len(volatilities), PRICE_MODEL_CORRELATION)
+    return GBMModel(volatilities, rng, interval,
+                    correlation=correlation,
+                    jump_rate=PRICE_MODEL_JUMP_RATE,
+                    jump_mean=PRICE_MODEL_JUMP_MEAN,
+                    jump_std=PRICE_MODEL_JUMP_STD)
+
+# Model name -> factory(volatilities, rng, interval)
+MODELS = {
+    'gbm': _gbm_from_env,
+    'uniform': UniformModel
+}
+
+# Make another model available by name
+def register_model(name, factory):
+    MODELS[name] = factory
+
+# Build a model for symbols with the given volatility classes, in the
+# same order as the prices it will be given, ticking every interval seconds
+def create_model(volatilities, interval, name=None, seed=None):
+    name = name or PRICE_MODEL
+    if seed is None and PRICE_MODEL_SEED is not None:
+        seed = int(PRICE_MODEL_SEED)
+    factory = MODELS.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown price model: {name}")
+    return factory(list(volatilities), np.random.default_rng(seed), interval)
@@ -0,0 +1,447 @@
+from flask import Response, request, has_request_context
+from psycopg.rows import dict_row
+import psycopg
+import os
+import asyncio
+import json
+import time
+import queue
+import atexit
+import threading
+from db import get_db_connection, db_connection
+from market_cache import get_snapshot, get_snapshot_at
+from price_engine import TICK_CHANNEL
+from trading import ACCOUNT_CHANNEL
+from instrumentation import register_collector
+from portfolio import load_account, load_account_async, value_portfolio
+from fill_model import bid_ask
+
+# Events buffered per client; a client that falls this far behind is resynced
+CLIENT_QUEUE_SIZE = int(os.environ.get('STREAM_CLIENT_QUEUE_SIZE', 64))
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT_INTERVAL = float(os.environ.get('STREAM_HEARTBEAT_INTERVAL', 15))
+# Close each stream after this many seconds. The browser reconnects on its
+# own, which also spreads long-lived streams across workers again.
+MAX_STREAM_AGE = float(os.environ.get('STREAM_MAX_AGE', 300))
+# Milliseconds the browser waits before reconnecting
+RETRY_MS = 3000
+# Whether pages open a live stream:
+#   auto - only where an open stream can't hold up other requests: under a
+#          threaded WSGI worker, or the ASGI app (default)
+#   1    - always
+#   0    - never; pages reload after a trade instead
+LIVE_STREAM = os.environ.get('LIVE_STREAM', 'auto')
+
+# One connected browser: its queue of pending events plus the user's cash
+# and positions, kept current from account events so prices can be valued
+# without going back to the database.
+class Subscription:
+    def __init__(self, user_id, cash, positions):
+        self.user_id = user_id
+        self.cash = cash
+        self.positions = positions
+        self.queue = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.overflowed = False
+
+# Fans price ticks and account changes out to every stream in this process.
+# A single listener thread LISTENs for the price engine's tick notifications
+# and for filled trades, builds each tick's message once, and hands it to
+# every subscriber's queue; it never blocks on a slow client.
+class Broadcaster:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._by_user = {}
+        self._snapshot = None
+        self._conn = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats = {
+            'ticks': 0,
+            'account_events': 0,
+            'overflows': 0
+        }
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='price-stream', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self._close_connection()
+
+    def subscribe(self, sub):
+        with self._lock:
+            self._subscribers.add(sub)
+            self._by_user.setdefault(sub.user_id, set()).add(sub)
+        self.start()
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+            subs = self._by_user.get(sub.user_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._by_user[sub.user_id]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['clients'] = len(self._subscribers)
+        return stats
+
+    # Publish a new market snapshot. Only quotes whose price moved since the
+    # last published snapshot are sent, and the message is encoded once.
+    def publish_snapshot(self, snapshot):
+        with self._lock:
+            previous = self._snapshot
+            if previous is not None and snapshot.version <= previous.version:
+                return
+            self._snapshot = snapshot
+            self._stats['ticks'] += 1
+            subscribers = list(self._subscribers)
+
+        changed = []
+        for quote in snapshot.sorted_quotes:
+            old = previous.get(quote['symbol']) if previous is not None else None
+            if old is None or old['price'] != quote['price']:
+                changed.append(quote)
+        if not changed or not subscribers:
+            return
+
+        message = _sse('prices', {
+            'version': snapshot.version,
+            'quotes': [_quote_delta(quote) for quote in changed]
+        }, event_id=snapshot.version)
+        event = ('prices', snapshot, frozenset(quote['symbol'] for quote in changed), message)
+        for sub in subscribers:
+            self._deliver(sub, event)
+
+    # Publish a filled trade to the streams of the user who made it
+    def publish_account(self, change):
+        with self._lock:
+            subscribers = list(self._by_user.get(change['user_id'], ()))
+            if subscribers:
+                self._stats['account_events'] += 1
+        for sub in subscribers:
+            self._deliver(sub, ('account', change))
+
+    def _deliver(self, sub, event):
+        try:
+            sub.queue.put_nowait(event)
+        except queue.Full:
+            # The client is too slow; it will be resent its full state
+            sub.overflowed = True
+            with self._lock:
+                self._stats['overflows'] += 1
+
+    # Server-Sent Events for one subscriber: the full market and account
+    # first, then only what changes
+    def events(self, sub):
+        self.subscribe(sub)
+        try:
+            snapshot = self._snapshot or get_snapshot()
+            yield f'retry: {RETRY_MS}\n\n'
+            yield from _full_state(sub, snapshot)
+
+            deadline = time.monotonic() + MAX_STREAM_AGE
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event = sub.queue.get(timeout=min(HEARTBEAT_INTERVAL, remaining))
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+
+                if sub.overflowed:
+                    # Events were lost: drop the backlog and resend everything
+                    _drain(sub.queue)
+                    sub.overflowed = False
+                    with db_connection() as conn:
+                        sub.cash, sub.positions = load_account(conn, sub.user_id)
+                    snapshot = self._snapshot or snapshot
+                    yield from _full_state(sub, snapshot)
+                    continue
+
+                snapshot, messages = _apply_event(sub, event, snapshot)
+                yield from messages
+        finally:
+            self.unsubscribe(sub)
+
+    # events() for the ASGI app: the same stream from an AsyncSubscription,
+    # waiting on the event loop instead of holding a thread
+    async def async_events(self, sub):
+        self.subscribe(sub)
+        try:
+            snapshot = self._snapshot or await asyncio.to_thread(get_snapshot)
+            yield f'retry: {RETRY_MS}\n\n'
+            for message in _full_state(sub, snapshot):
+                yield message
+
+            deadline = time.monotonic() + MAX_STREAM_AGE
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event = await sub.queue.get(timeout=min(HEARTBEAT_INTERVAL, remaining))
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+
+                if sub.overflowed:
+                    sub.queue.clear()
+                    sub.overflowed = False
+                    sub.cash, sub.positions = await load_account_async(sub.user_id)
+                    snapshot = self._snapshot or snapshot
+                    for message in _full_state(sub, snapshot):
+                        yield message
+                    continue
+
+                snapshot, messages = _apply_event(sub, event, snapshot)
+                for message in messages:
+                    yield message
+        finally:
+            self.unsubscribe(sub)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._conn is None:
+                    self._connect()
+                    # Catch up on any tick missed while (re)connecting
+                    self.publish_snapshot(get_snapshot())
+                for notify in self._conn.notifies(timeout=1.0):
+                    self._handle(notify)
+            except Exception as e:
+                print(f"Price stream listener error: {e}")
+                self._close_connection()
+                self._stop.wait(1)
+
+    def _handle(self, notify):
+        if notify.channel == TICK_CHANNEL:
+            self.publish_snapshot(get_snapshot_at(int(notify.payload)))
+        elif notify.channel == ACCOUNT_CHANNEL:
+            change = json.loads(notify.payload)
+            if change['user_id'] in self._by_user:
+                self.publish_account(change)
+
+    # LISTEN needs a session of its own, so the listener keeps a dedicated
+    # connection rather than holding one from the request pool
+    def _connect(self):
+        self._conn = psycopg.connect(
+            os.environ.get('DATABASE_URL'),
+            row_factory=dict_row,
+            autocommit=True
+        )
+        self._conn.execute(f'LISTEN {TICK_CHANNEL}')
+        self._conn.execute(f'LISTEN {ACCOUNT_CHANNEL}')
+
+    def _close_connection(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+# Bounded queue filled by the listener thread and read on an event loop.
+# put_nowait() is thread-safe and raises queue.Full like queue.Queue, so the
+# broadcaster delivers to it the same way.
+class LoopQueue:
+    def __init__(self, loop, maxsize):
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._maxsize = maxsize
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def put_nowait(self, event):
+        with self._lock:
+            if self._size >= self._maxsize:
+                raise queue.Full
+            self._size += 1
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+        except RuntimeError:
+            # The loop has closed; the stream is going away
+            pass
+
+    # Wait up to timeout seconds for the next event (asyncio.TimeoutError)
+    async def get(self, timeout):
+        event = await asyncio.wait_for(self._queue.get(), timeout)
+        with self._lock:
+            self._size -= 1
+        return event
+
+    def clear(self):
+        while True:
+            try:
+                self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            with self._lock:
+                self._size -= 1
+
+# A Subscription read on the running event loop
+class AsyncSubscription(Subscription):
+    def __init__(self, user_id, cash, positions):
+        super().__init__(user_id, cash, positions)
+        self.queue = LoopQueue(asyncio.get_running_loop(), CLIENT_QUEUE_SIZE)
+
+def _drain(q):
+    while True:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            return
+
+# Format one Server-Sent Event
+def _sse(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+# The full market and account, sent first and after a resync
+def _full_state(sub, snapshot):
+    return [_market_event(snapshot), _account_event(sub, snapshot, full=True)]
+
+# Messages for one queued event. Account events also update the
+# subscriber's cash and positions. Returns (latest snapshot, messages).
+def _apply_event(sub, event, snapshot):
+    if event[0] == 'prices':
+        _, snapshot, changed, message = event
+        messages = [message]
+        held = changed & sub.positions.keys()
+        if held:
+            messages.append(_account_event(sub, snapshot, symbols=held))
+        return snapshot, messages
+
+    change = event[1]
+    symbol = change['symbol']
+    sub.cash = float(change['cash'])
+    if change['shares'] > 0:
+        sub.positions[symbol] = {
+            'shares': change['shares'],
+            'avg_price': float(change['avg_price'])
+        }
+    else:
+        sub.positions.pop(symbol, None)
+    return snapshot, [_account_event(sub, snapshot, symbols=[symbol])]
+
+def _quote_delta(quote):
+    bid, ask = bid_ask(quote)
+    return {
+        'symbol': quote['symbol'],
+        'price': quote['price'],
+        'bid': bid,
+        'ask': ask,
+        'change': quote['change'],
+        'percent': quote['percent']
+    }
+
+def _market_event(snapshot):
+    return _sse('market', {
+        'version': snapshot.version,
+        'quotes': [_quote_delta(quote) for quote in snapshot.sorted_quotes]
+    }, event_id=snapshot.version)
+
+# The user's cash, total value and the valuation of the given positions
+# (all of them if full). Positions closed since the last event are listed
+# in 'closed' so the client can remove their rows.
+def _account_event(sub, snapshot, symbols=None, full=False):
+    valuation = value_portfolio(sub.positions, snapshot, sub.cash)
+    if full:
+        symbols = sub.positions.keys()
+
+    return _sse('account', {
+        'full': full,
+        'cash': sub.cash,
+        'total_value': valuation.total_value,
+        'positions': valuation.rows(only=set(symbols)),
+        'closed': sorted(symbol for symbol in symbols if symbol not in sub.positions)
+    })
+
+_broadcaster = None
+_broadcaster_pid = None
+_broadcaster_lock = threading.Lock()
+
+# Get this process's broadcaster; its listener starts with the first stream
+def get_broadcaster():
+    global _broadcaster, _broadcaster_pid
+
+    with _broadcaster_lock:
+        if _broadcaster is None or _broadcaster_pid != os.getpid():
+            _broadcaster = Broadcaster()
+            _broadcaster_pid = os.getpid()
+            atexit.register(_broadcaster.stop)
+
+    return _broadcaster
+
+# Whether this request's page should stream. Each open stream occupies the
+# thread serving it, so under a single-threaded worker (gunicorn's default
+# sync worker) one open tab would block everyone else's requests.
+def streaming_enabled():
+    if LIVE_STREAM in ('0', '1'):
+        return LIVE_STREAM == '1'
+    if has_request_context():
+        return request.environ.get('wsgi.multithread', False)
+    # The ASGI app, where streams wait on the event loop
+    return True
+
+# Headers for a streaming response (Flask's or Quart's): not to be cached,
+# or buffered by a proxy in front of the app
+def stream_headers(response):
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Build the streaming response for a user. The account is loaded on the
+# request's connection, which is returned to the pool before streaming
+# starts, so an open stream does not hold a database connection.
+# Where streaming is off, answers 204, which tells the browser not to
+# reconnect.
+def stream_response(user):
+    if not streaming_enabled():
+        return Response(status=204)
+    cash, positions = load_account(get_db_connection(), user['user_id'])
+    sub = Subscription(user['user_id'], cash, positions)
+    return stream_headers(Response(get_broadcaster().events(sub), mimetype='text/event-stream'))
+
+# The Server-Sent Events of a stream for the ASGI app. The account is
+# loaded up front; the stream itself holds no database connection.
+async def open_async_stream(user):
+    cash, positions = await load_account_async(user['user_id'])
+    sub = AsyncSubscription(user['user_id'], cash, positions)
+    return get_broadcaster().async_events(sub)
+
+# Stream counters for /metrics
+def _collect_metrics():
+    if _broadcaster is None or _broadcaster_pid != os.getpid():
+        return []
+
+    stats = _broadcaster.stats()
+    return [
+        ('trading_stream_clients', 'gauge', 'Open live price streams.',
+         [({}, stats['clients'])]),
+        ('trading_stream_events_total', 'counter', 'Events fanned out to live streams by kind.',
+         [({'kind': kind}, stats[kind]) for kind in ('ticks', 'account_events', 'overflows')])
+    ]
+
+# Register the stream's metrics with a Flask app
+def init_app(app):
+    register_collector(_collect_metrics)
+    app.context_processor(lambda: {'live_stream': streaming_enabled()})
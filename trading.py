@@ -0,0 +1,310 @@
+from decimal import Decimal, ROUND_HALF_UP
+from db import db_connection
+from async_db import async_connection
+from user_state import USER_STATE_CHANNEL, apply_trade
+
+# NOTIFY channel carrying each filled trade's new cash and position, so
+# live streams in every worker can push the change to the user's browser.
+# Delivered only when the trade commits.
+ACCOUNT_CHANNEL = 'account_events'
+
+# Both trade statements also fill resting orders (see orders.py): given an
+# order_id they only trade while the order is still open, locking it first
+# so a concurrent cancel can't slip in, and then mark it filled or rejected.
+# Market orders pass order_id NULL, which skips both steps.
+# A filled trade also bumps the user's state_version and announces it on
+# USER_STATE_CHANNEL, so other processes drop their cached copy.
+
+# Buy: debit cash only if the user can afford it, then upsert the position
+# and append the trade. The conditional UPDATE takes the row lock on the
+# user, so concurrent trades for one user are serialised by the database.
+BUY_SQL = '''
+    WITH claimed AS (
+        SELECT order_id FROM orders
+        WHERE order_id = %(order_id)s AND status = 'open'
+        FOR UPDATE
+    ),
+    account AS (
+        UPDATE users
+        SET current_cash = current_cash - %(total)s,
+            trade_count = trade_count + 1,
+            day_trade_count = CASE WHEN last_trade_at::date = CURRENT_DATE
+                                   THEN day_trade_count + 1 ELSE 1 END,
+            streak_days = CASE WHEN last_trade_at::date = CURRENT_DATE THEN streak_days
+                               WHEN last_trade_at::date = CURRENT_DATE - 1 THEN streak_days + 1
+                               ELSE 1 END,
+            first_trade_at = COALESCE(first_trade_at, CURRENT_TIMESTAMP),
+            last_trade_at = CURRENT_TIMESTAMP,
+            state_version = state_version + 1
+        WHERE session_id = %(session_id)s AND current_cash >= %(total)s
+          AND (%(order_id)s::int IS NULL OR EXISTS (SELECT 1 FROM claimed))
+        RETURNING user_id, current_cash, trade_count, day_trade_count, streak_days,
+                  first_trade_at, last_trade_at, realized_pnl, achievements_version, state_version
+    ),
+    position AS (
+        INSERT INTO portfolio (user_id, session_id, symbol, shares, avg_price)
+        SELECT user_id, %(session_id)s, %(symbol)s, %(shares)s, %(price)s FROM account
+        ON CONFLICT (user_id, symbol) DO UPDATE
+        SET shares = portfolio.shares + EXCLUDED.shares,
+            avg_price = (portfolio.shares * portfolio.avg_price + EXCLUDED.shares * EXCLUDED.avg_price)
+                        / (portfolio.shares + EXCLUDED.shares),
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING shares, avg_price
+    ),
+    trade AS (
+        INSERT INTO trades (user_id, session_id, symbol, action, shares, price, total_cost)
+        SELECT user_id, %(session_id)s, %(symbol)s, 'BUY', %(shares)s, %(price)s, %(total)s FROM account
+        RETURNING trade_id, timestamp
+    ),
+    settled AS (
+        UPDATE orders
+        SET status = CASE WHEN EXISTS (SELECT 1 FROM trade) THEN 'filled' ELSE 'rejected' END,
+            reason = CASE WHEN EXISTS (SELECT 1 FROM trade) THEN NULL ELSE 'insufficient_funds' END,
+            fill_price = (SELECT %(price)s FROM trade),
+            trade_id = (SELECT trade_id FROM trade),
+            closed_at = CURRENT_TIMESTAMP
+        WHERE order_id = (SELECT order_id FROM claimed)
+    )
+    SELECT
+        EXISTS (SELECT 1 FROM users WHERE session_id = %(session_id)s) AS user_exists,
+        (SELECT user_id FROM account) AS user_id,
+        (SELECT achievements_version FROM account) AS achievements_version,
+        (SELECT state_version FROM account) AS state_version,
+        (SELECT current_cash FROM account) AS cash,
+        (SELECT trade_count FROM account) AS trade_count,
+        (SELECT day_trade_count FROM account) AS day_trade_count,
+        (SELECT streak_days FROM account) AS streak_days,
+        (SELECT first_trade_at FROM account) AS first_trade_at,
+        (SELECT last_trade_at FROM account) AS last_trade_at,
+        (SELECT realized_pnl FROM account) AS realized_pnl,
+        (SELECT shares FROM position) AS position_shares,
+        (SELECT avg_price FROM position) AS position_avg_price,
+        (SELECT trade_id FROM trade) AS trade_id,
+        (SELECT timestamp FROM trade) AS timestamp,
+        (SELECT pg_notify(%(channel)s, json_build_object(
+             'user_id', a.user_id, 'cash', a.current_cash, 'symbol', %(symbol)s::varchar,
+             'shares', p.shares, 'avg_price', p.avg_price)::text)
+         FROM account a CROSS JOIN position p) AS notified,
+        (SELECT pg_notify(%(state_channel)s, json_build_object(
+             'user_id', user_id, 'version', state_version)::text)
+         FROM account) AS state_notified
+'''
+
+# Sell: reduce the position only if it holds enough shares (deleting it when
+# it reaches zero), then credit cash and append the trade. The UPDATE and
+# DELETE branches have mutually exclusive conditions so only one touches the row.
+# The user row is locked before the position, in the same order as buys, so
+# a concurrent buy and sell cannot deadlock.
+SELL_SQL = '''
+    WITH claimed AS (
+        SELECT order_id FROM orders
+        WHERE order_id = %(order_id)s AND status = 'open'
+        FOR UPDATE
+    ),
+    locked AS (
+        SELECT user_id FROM users
+        WHERE session_id = %(session_id)s
+          AND (%(order_id)s::int IS NULL OR EXISTS (SELECT 1 FROM claimed))
+        FOR UPDATE
+    ),
+    reduced AS (
+        UPDATE portfolio
+        SET shares = shares - %(shares)s, updated_at = CURRENT_TIMESTAMP
+        WHERE user_id = (SELECT user_id FROM locked) AND symbol = %(symbol)s AND shares > %(shares)s
+        RETURNING shares, avg_price
+    ),
+    closed AS (
+        DELETE FROM portfolio
+        WHERE user_id = (SELECT user_id FROM locked) AND symbol = %(symbol)s AND shares = %(shares)s
+        RETURNING 0 AS shares, avg_price
+    ),
+    position AS (
+        SELECT shares, avg_price FROM reduced
+        UNION ALL
+        SELECT shares, avg_price FROM closed
+    ),
+    account AS (
+        UPDATE users
+        SET current_cash = current_cash + %(total)s,
+            trade_count = trade_count + 1,
+            day_trade_count = CASE WHEN last_trade_at::date = CURRENT_DATE
+                                   THEN day_trade_count + 1 ELSE 1 END,
+            streak_days = CASE WHEN last_trade_at::date = CURRENT_DATE THEN streak_days
+                               WHEN last_trade_at::date = CURRENT_DATE - 1 THEN streak_days + 1
+                               ELSE 1 END,
+            first_trade_at = COALESCE(first_trade_at, CURRENT_TIMESTAMP),
+            last_trade_at = CURRENT_TIMESTAMP,
+            state_version = state_version + 1,
+            realized_pnl = realized_pnl + (SELECT (%(price)s - avg_price) * %(shares)s FROM position)
+        WHERE user_id = (SELECT user_id FROM locked) AND EXISTS (SELECT 1 FROM position)
+        RETURNING user_id, current_cash, trade_count, day_trade_count, streak_days,
+                  first_trade_at, last_trade_at, realized_pnl, achievements_version, state_version
+    ),
+    trade AS (
+        INSERT INTO trades (user_id, session_id, symbol, action, shares, price, total_cost)
+        SELECT user_id, %(session_id)s, %(symbol)s, 'SELL', %(shares)s, %(price)s, %(total)s FROM account
+        RETURNING trade_id, timestamp
+    ),
+    settled AS (
+        UPDATE orders
+        SET status = CASE WHEN EXISTS (SELECT 1 FROM trade) THEN 'filled' ELSE 'rejected' END,
+            reason = CASE WHEN EXISTS (SELECT 1 FROM trade) THEN NULL ELSE 'insufficient_shares' END,
+            fill_price = (SELECT %(price)s FROM trade),
+            trade_id = (SELECT trade_id FROM trade),
+            closed_at = CURRENT_TIMESTAMP
+        WHERE order_id = (SELECT order_id FROM claimed)
+    )
+    SELECT
+        EXISTS (SELECT 1 FROM users WHERE session_id = %(session_id)s) AS user_exists,
+        (SELECT user_id FROM account) AS user_id,
+        (SELECT achievements_version FROM account) AS achievements_version,
+        (SELECT state_version FROM account) AS state_version,
+        (SELECT current_cash FROM account) AS cash,
+        (SELECT trade_count FROM account) AS trade_count,
+        (SELECT day_trade_count FROM account) AS day_trade_count,
+        (SELECT streak_days FROM account) AS streak_days,
+        (SELECT first_trade_at FROM account) AS first_trade_at,
+        (SELECT last_trade_at FROM account) AS last_trade_at,
+        (SELECT realized_pnl FROM account) AS realized_pnl,
+        (SELECT shares FROM position) AS position_shares,
+        (SELECT avg_price FROM position) AS position_avg_price,
+        (SELECT trade_id FROM trade) AS trade_id,
+        (SELECT timestamp FROM trade) AS timestamp,
+        (SELECT pg_notify(%(channel)s, json_build_object(
+             'user_id', a.user_id, 'cash', a.current_cash, 'symbol', %(symbol)s::varchar,
+             'shares', p.shares, 'avg_price', p.avg_price)::text)
+         FROM account a CROSS JOIN position p) AS notified,
+        (SELECT pg_notify(%(state_channel)s, json_build_object(
+             'user_id', user_id, 'version', state_version)::text)
+         FROM account) AS state_notified
+'''
+
+TRADE_SQL = {
+    'buy': BUY_SQL,
+    'sell': SELL_SQL
+}
+
+def _money(value):
+    return Decimal(str(value)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+def _trade_params(session_id, symbol, shares, price, order_id=None):
+    price = _money(price)
+    return {
+        'session_id': session_id,
+        'symbol': symbol,
+        'shares': shares,
+        'price': price,
+        'total': _money(price * shares),
+        'order_id': order_id,
+        'channel': ACCOUNT_CHANNEL,
+        'state_channel': USER_STATE_CHANNEL
+    }
+
+def _trade_result(row, action, params):
+    if row['trade_id'] is None:
+        if not row['user_exists']:
+            reason = 'user_not_found'
+        elif action == 'buy':
+            reason = 'insufficient_funds'
+        else:
+            reason = 'insufficient_shares'
+        return {'success': False, 'reason': reason}
+
+    return {
+        'success': True,
+        'user_id': row['user_id'],
+        'achievements_version': row['achievements_version'],
+        'state_version': row['state_version'],
+        'cash': float(row['cash']),
+        'is_first_trade': row['trade_count'] == 1,
+        'stats': {
+            'trade_count': row['trade_count'],
+            'day_trade_count': row['day_trade_count'],
+            'streak_days': row['streak_days'],
+            'first_trade_at': row['first_trade_at'],
+            'last_trade_at': row['last_trade_at'],
+            'realized_pnl': float(row['realized_pnl'])
+        },
+        'position': {
+            'symbol': params['symbol'],
+            'shares': row['position_shares'],
+            'avg_price': float(row['position_avg_price'])
+        },
+        'trade': {
+            'trade_id': row['trade_id'],
+            'symbol': params['symbol'],
+            'action': action.upper(),
+            'shares': params['shares'],
+            'price': float(params['price']),
+            'total': float(params['total']),
+            'timestamp': row['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
+        }
+    }
+
+# Execute a market order atomically in one round trip.
+# Returns a dict with 'success' and, on failure, a 'reason' of
+# 'invalid_action', 'user_not_found', 'insufficient_funds' or
+# 'insufficient_shares'. On success it also has 'user_id',
+# 'achievements_version' (to validate cached badges), 'state_version' (see
+# user_state.py, which the trade is written through to), 'cash', 'position'
+# (symbol, shares, avg_price), 'trade' (the new history row), 'stats'
+# (the user's updated trade statistics, including trades today and the
+# consecutive trading day streak) and 'is_first_trade'.
+def execute_trade(session_id, symbol, action, shares, price):
+    sql = TRADE_SQL.get(action)
+    if sql is None:
+        return {'success': False, 'reason': 'invalid_action'}
+
+    params = _trade_params(session_id, symbol, shares, price)
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        row = cur.fetchone()
+        conn.commit()
+        cur.close()
+
+    result = _trade_result(row, action, params)
+    if result['success']:
+        apply_trade(result)
+    return result
+
+# execute_trade() for the ASGI app, on an async pooled connection. The
+# statement is atomic on its own, so it needs no explicit transaction.
+async def execute_trade_async(session_id, symbol, action, shares, price):
+    sql = TRADE_SQL.get(action)
+    if sql is None:
+        return {'success': False, 'reason': 'invalid_action'}
+
+    params = _trade_params(session_id, symbol, shares, price)
+    async with async_connection() as conn:
+        cur = await conn.execute(sql, params)
+        row = await cur.fetchone()
+
+    result = _trade_result(row, action, params)
+    if result['success']:
+        apply_trade(result)
+    return result
+
+# Fill a batch of triggered resting orders on cur, inside the caller's
+# transaction. fills are dicts with order_id, session_id, symbol, action,
+# shares and price. Each fill is one trade statement and the batch is sent
+# with executemany, which pipelines it into a single round trip; sells go
+# first so their proceeds can fund buys in the same batch. Orders that
+# can't be afforded (or covered) are marked rejected.
+# Returns order_id -> result, as from execute_trade().
+def fill_orders(cur, fills):
+    results = {}
+    for action in ('sell', 'buy'):
+        batch = [fill for fill in fills if fill['action'] == action]
+        if not batch:
+            continue
+
+        params = [
+            _trade_params(fill['session_id'], fill['symbol'], fill['shares'],
+                          fill['price'], fill['order_id'])
+            for fill in batch
+        ]
+        cur.executemany(TRADE_SQL[action], params, returning=True)
+        for fill, fill_params, result in zip(batch, params, cur.results()):
+            results[fill['order_id']] = _trade_result(result.fetchone(), action, fill_params)
+    return results
@@ -0,0 +1,225 @@
+from flask import Blueprint, render_template, request, jsonify, session
+import random
+from market_cache import get_snapshot
+from user_context import load_user, load_user_state
+from portfolio import value_portfolio
+from fill_model import bid_ask
+from orders import place_order, cancel_order
+from price_stream import stream_response
+from dashboard_api import init_app as init_dashboard_api
+from core import TRADE_ERRORS, failure, log_event, trade_event, execute_market_order, bind_platform
+
+# The traditional platform: brokerage-style account, market table and
+# order entry with limit and stop orders
+bp = Blueprint('traditional', __name__)
+
+@bp.before_request
+def _bind_platform():
+    return bind_platform('traditional')
+
+# Messages for failed orders, on top of the shared trade errors
+ORDER_ERRORS = dict(TRADE_ERRORS, **{
+    'invalid_order_type': 'Invalid order type',
+    'invalid_time_in_force': 'Invalid time in force',
+    'invalid_price': 'Please enter a valid limit or stop price',
+    'not_marketable': 'Order could not be filled immediately and was cancelled'
+})
+
+def _price_param(data, key):
+    try:
+        return float(data[key]) if data.get(key) not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+# place_order() keyword arguments from an order ticket
+def order_options(data):
+    return {
+        'limit_price': _price_param(data, 'limit_price'),
+        'stop_price': _price_param(data, 'stop_price'),
+        'time_in_force': data.get('time_in_force', 'day')
+    }
+
+def init_user():
+    return load_user('traditional')
+
+# Format the market snapshot for the traditional market table.
+# Built once per price tick and shared by all requests until the next one.
+def _format_market_data(snapshot):
+    market_data = []
+    for quote in snapshot.sorted_quotes:
+        current = quote['price']
+        
+        # Spread widens with the symbol's volatility (see fill_model)
+        bid, ask = bid_ask(quote)
+        
+        market_data.append({
+            'symbol': quote['symbol'],
+            'name': quote['name'],
+            'bid': bid,
+            'ask': ask,
+            'last': current,
+            'change': quote['change'],
+            'change_percent': quote['percent'],
+            'volume': f"{random.randint(10, 250)}M"
+        })
+    
+    return market_data, {stock['symbol']: stock for stock in market_data}
+
+# Get current stock prices.
+# Returns (market_data list, symbol -> stock mapping).
+def get_market_data():
+    return get_snapshot().view('traditional', _format_market_data)
+
+# JSON endpoints for refreshing parts of the dashboard without a page load
+init_dashboard_api(bp, init_user, get_market_data)
+
+# Template variables for the account page, from the user, the market
+# snapshot and the user's state (see user_context.load_user_state())
+def index_context(user, snapshot, state):
+    current_cash = user['current_cash']
+    
+    # Calculate portfolio value
+    market_data, _ = snapshot.view('traditional', _format_market_data)
+    valuation = value_portfolio(state.positions, snapshot, current_cash)
+    portfolio_value = valuation.total_value
+    
+    account_summary = {
+        'total_value': portfolio_value,
+        'cash_balance': current_cash,
+        'buying_power': current_cash * 2,
+        'today_change': portfolio_value - 100000.00,
+        'today_change_percent': ((portfolio_value - 100000.00) / 100000.00 * 100),
+        'trade_count': user['trade_count'],
+        'realized_pnl': user['realized_pnl']
+    }
+    
+    # Format history
+    formatted_history = []
+    for trade in state.history[:20]:
+        formatted_history.append({
+            'symbol': trade['symbol'],
+            'side': trade['action'],
+            'shares': trade['shares'],
+            'price': float(trade['price']),
+            'total': float(trade['total_cost']),
+            'timestamp': trade['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
+        })
+    
+    return {
+        'account_summary': account_summary,
+        'positions': valuation.rows(),
+        'market_data': market_data,
+        'orders': state.orders,
+        'history': formatted_history
+    }
+
+@bp.route('/')
+def index():
+    user = init_user()
+    log_event('page_view', {'page': 'home'})
+    
+    context = index_context(user, get_snapshot(), load_user_state(user))
+    return render_template('traditional.html', **context)
+
+# The order on an order ticket (also its trade_attempt event). place_order()
+# options are read separately, by order_options().
+# Raises ValueError if shares isn't a whole number.
+def parse_order(data):
+    return {
+        'symbol': data.get('symbol', '').upper(),
+        'shares': int(data.get('shares', 0)),
+        'action': data.get('action'),
+        'order_type': data.get('order_type', 'market')
+    }
+
+# Reply refusing an order that can't be placed, or None
+def check_order(order):
+    if not order['symbol'] or order['shares'] <= 0:
+        return failure('Invalid order parameters')
+    return None
+
+# Place a limit or stop order for user at the current quote.
+# Returns the place_order() result, with reason 'unknown_symbol' if the
+# symbol isn't quoted.
+def place_ticket(user, order, options):
+    quote = get_snapshot().get(order['symbol'])
+    if not quote:
+        return {'success': False, 'reason': 'unknown_symbol'}
+    return place_order(user, quote, order['action'], order['order_type'], order['shares'], **options)
+
+# Clickstream events for a placed order's result, as (event type, data).
+# Market orders are logged as they fill, by execute_market_order().
+def order_events(order, result):
+    if not result['success']:
+        return []
+    if 'order' in result:
+        return [('order_placed', result['order'])]
+    if order['order_type'] != 'market':
+        # Filled at once
+        return [('trade_completed', trade_event(order['symbol'], order['action'], order['shares'], result))]
+    return []
+
+# Reply to a placed order: the resting order, the fill, or why it failed
+def order_reply(order, result):
+    if not result['success']:
+        return failure(ORDER_ERRORS[result['reason']])
+
+    symbol, action, shares = order['symbol'], order['action'], order['shares']
+    if 'order' in result:
+        return {
+            'success': True,
+            'message': f"Order placed: {action.title()} {shares} shares of {symbol} ({order['order_type']})",
+            'order': result['order']
+        }
+    
+    filled = result['trade']
+    verb = 'Bought' if action == 'buy' else 'Sold'
+    return {
+        'success': True,
+        'message': f'Order filled: {verb} {shares} shares of {symbol} at ${filled["price"]:.2f}',
+        'cash': result['cash'],
+        'position': result['position'],
+        'trade': filled
+    }
+
+# Reply to cancelling an order
+def cancel_reply(cancelled):
+    if not cancelled:
+        return failure('Order is no longer open')
+    return {'success': True, 'message': 'Order cancelled'}
+
+@bp.route('/trade', methods=['POST'])
+def trade():
+    if 'session_id' not in session or 'user_id' not in session:
+        init_user()
+    
+    data = request.json
+    order = parse_order(data)
+    log_event('trade_attempt', order)
+    
+    refusal = check_order(order)
+    if refusal:
+        return jsonify(refusal)
+    
+    if order['order_type'] == 'market':
+        result = execute_market_order(order['symbol'], order['action'], order['shares'])
+    else:
+        result = place_ticket(init_user(), order, order_options(data))
+    
+    for event_type, event_data in order_events(order, result):
+        log_event(event_type, event_data)
+    return jsonify(order_reply(order, result))
+
+@bp.route('/orders/<int:order_id>/cancel', methods=['POST'])
+def cancel(order_id):
+    user = init_user()
+    
+    cancelled = cancel_order(user['user_id'], order_id)
+    if cancelled:
+        log_event('order_cancelled', {'order_id': order_id})
+    return jsonify(cancel_reply(cancelled))
+
+# Live prices and account changes as Server-Sent Events
+@bp.route('/stream')
+def stream():
+    return stream_response(init_user())
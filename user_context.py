@@ -0,0 +1,171 @@
+from flask import g, session
+import os
+import asyncio
+from db import get_db_connection, db_connection
+from async_db import fetch_one, fetch_all
+from orders import list_open_orders, list_open_orders_async
+from user_state import HISTORY_SIZE, UserState, get_user_state_cache
+
+STARTING_CASH = 100000.00
+
+# Resolve the session's user, creating it if needed, in one statement.
+# An existing user is only read, so page views don't write to users. The
+# INSERT ... ON CONFLICT DO NOTHING covers a concurrent first request for
+# the same session; the loser simply retries and reads the row.
+LOAD_USER_SQL = '''
+    WITH existing AS (
+        SELECT user_id, session_id, platform_type, created_at, initial_cash, current_cash,
+               trade_count, day_trade_count, streak_days, green_days, achievements_version,
+               first_trade_at, last_trade_at, realized_pnl, state_version
+        FROM users
+        WHERE session_id = %(session_id)s
+    ),
+    inserted AS (
+        INSERT INTO users (session_id, platform_type, initial_cash, current_cash)
+        SELECT %(session_id)s, %(platform_type)s, %(cash)s, %(cash)s
+        WHERE NOT EXISTS (SELECT 1 FROM existing)
+        ON CONFLICT (session_id) DO NOTHING
+        RETURNING user_id, session_id, platform_type, created_at, initial_cash, current_cash,
+                  trade_count, day_trade_count, streak_days, green_days, achievements_version,
+                  first_trade_at, last_trade_at, realized_pnl, state_version
+    )
+    SELECT *, FALSE AS created FROM existing
+    UNION ALL
+    SELECT *, TRUE AS created FROM inserted
+'''
+
+# Load the current request's user, creating it on first visit.
+# Returns a dict with the user's profile, cash and trade stats plus 'created'.
+# The result is cached on flask.g, so the row is read at most once per request,
+# and a user in the user state cache (see user_state.py) costs no query.
+def load_user(platform_type):
+    if 'user' in g:
+        return g.user
+
+    if 'session_id' not in session:
+        session['session_id'] = os.urandom(16).hex()
+
+    user = _cached_user(session)
+    if user is not None:
+        g.user = user
+        return user
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    params = {
+        'session_id': session['session_id'],
+        'platform_type': platform_type,
+        'cash': STARTING_CASH
+    }
+    cur.execute(LOAD_USER_SQL, params)
+    row = cur.fetchone()
+    if row is None:
+        # Lost an insert race with a concurrent request; the row exists now
+        cur.execute(LOAD_USER_SQL, params)
+        row = cur.fetchone()
+    if row['created']:
+        conn.commit()
+    cur.close()
+
+    user = _user_from_row(row)
+    session['user_id'] = user['user_id']
+    g.user = user
+    return user
+
+# load_user() for the ASGI app, on an async pooled connection (in autocommit,
+# so a new user is committed by the statement itself). session is the
+# request's session; caching the user for the request is left to the caller.
+async def load_user_async(session, platform_type):
+    if 'session_id' not in session:
+        session['session_id'] = os.urandom(16).hex()
+
+    user = _cached_user(session)
+    if user is not None:
+        return user
+
+    params = {
+        'session_id': session['session_id'],
+        'platform_type': platform_type,
+        'cash': STARTING_CASH
+    }
+    row = await fetch_one(LOAD_USER_SQL, params)
+    if row is None:
+        row = await fetch_one(LOAD_USER_SQL, params)
+
+    user = _user_from_row(row)
+    session['user_id'] = user['user_id']
+    return user
+
+def _user_from_row(row):
+    user = dict(row)
+    for column in ('initial_cash', 'current_cash', 'realized_pnl'):
+        user[column] = float(user[column])
+    return user
+
+# The session's user from the user state cache, or None
+def _cached_user(session):
+    if 'user_id' not in session:
+        return None
+    state = get_user_state_cache().get(session['user_id'], session['session_id'])
+    if state is None:
+        return None
+    return dict(state.user, created=False)
+
+POSITIONS_SQL = '''
+    SELECT symbol, shares, avg_price
+    FROM portfolio
+    WHERE user_id = %s
+'''
+HISTORY_SQL = '''
+    SELECT symbol, action, shares, price, total_cost, timestamp
+    FROM trades
+    WHERE user_id = %s
+    ORDER BY timestamp DESC
+    LIMIT %s
+'''
+
+def _positions_from_rows(rows):
+    return {
+        row['symbol']: {'shares': row['shares'], 'avg_price': float(row['avg_price'])}
+        for row in rows
+    }
+
+# The dashboard state of a user from load_user(): positions, recent trades
+# and open orders. Served from the user state cache while the user's
+# state_version is unchanged; otherwise read and cached.
+def load_user_state(user):
+    cache = get_user_state_cache()
+    state = cache.get(user['user_id'], user['session_id'])
+    if state is not None and state.version == user['state_version']:
+        return state
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(POSITIONS_SQL, (user['user_id'],))
+        positions = _positions_from_rows(cur.fetchall())
+        cur.execute(HISTORY_SQL, (user['user_id'], HISTORY_SIZE))
+        history = cur.fetchall()
+        cur.close()
+        orders = list_open_orders(conn, user['user_id'])
+
+    state = UserState(dict(user, created=False), positions, history, orders)
+    cache.put(state)
+    return state
+
+# load_user_state() for the ASGI app; a miss reads positions, trades and
+# orders concurrently on the async pool
+async def load_user_state_async(user):
+    cache = get_user_state_cache()
+    state = cache.get(user['user_id'], user['session_id'])
+    if state is not None and state.version == user['state_version']:
+        return state
+
+    positions, history, orders = await asyncio.gather(
+        fetch_all(POSITIONS_SQL, (user['user_id'],)),
+        fetch_all(HISTORY_SQL, (user['user_id'], HISTORY_SIZE)),
+        list_open_orders_async(user['user_id'])
+    )
+
+    state = UserState(dict(user, created=False), _positions_from_rows(positions), history, orders)
+    cache.put(state)
+    return state
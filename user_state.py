@@ -0,0 +1,291 @@
+from collections import OrderedDict
+from psycopg.rows import dict_row
+import psycopg
+import os
+import json
+import time
+import atexit
+import threading
+from instrumentation import register_collector
+
+# NOTIFY channel carrying a user's new state_version whenever anything shown
+# on their dashboard changes: trades, orders and badges. Every process
+# listens and drops its cached copy of the user.
+USER_STATE_CHANNEL = 'user_state'
+
+# Users whose state each process keeps in memory
+CACHE_SIZE = int(os.environ.get('USER_STATE_CACHE_SIZE', 10000))
+# Seconds a cached user is served before being re-read, as a backstop for
+# a missed notification
+TTL = float(os.environ.get('USER_STATE_TTL', 300))
+# Trades kept per user, enough for either platform's history table
+HISTORY_SIZE = 20
+
+# One user's dashboard state as of a state_version: their users row (see
+# user_context.load_user()), positions (symbol -> shares, avg_price), most
+# recent trades, newest first, and open orders. Never changed in place: a
+# write-through replaces the cached object, so a request can keep reading
+# the one it was given.
+class UserState:
+    def __init__(self, user, positions, history, orders, loaded_at=None, memo=None):
+        self.user = user
+        self.version = user['state_version']
+        self.positions = positions
+        self.history = history
+        self.orders = orders
+        self.loaded_at = loaded_at if loaded_at is not None else time.monotonic()
+        self._memo = memo if memo is not None else {}
+
+    # A value derived from the user that changes on its own schedule (such as
+    # their rank, every leaderboard refresh), kept while version is unchanged
+    def memo(self, key, version, loader):
+        found = self._memo.get(key)
+        if found is not None and found[0] == version:
+            return found[1]
+        value = loader()
+        self._memo[key] = (version, value)
+        return value
+
+    async def memo_async(self, key, version, loader):
+        found = self._memo.get(key)
+        if found is not None and found[0] == version:
+            return found[1]
+        value = await loader()
+        self._memo[key] = (version, value)
+        return value
+
+    # The state after one of the user's own trades, from a successful
+    # execute_trade() result
+    def with_trade(self, result):
+        stats = result['stats']
+        user = dict(self.user,
+                    current_cash=result['cash'],
+                    achievements_version=result['achievements_version'],
+                    state_version=result['state_version'],
+                    **stats)
+
+        position = result['position']
+        positions = dict(self.positions)
+        if position['shares'] > 0:
+            positions[position['symbol']] = {
+                'shares': position['shares'],
+                'avg_price': position['avg_price']
+            }
+        else:
+            positions.pop(position['symbol'], None)
+
+        trade = result['trade']
+        history = [{
+            'symbol': trade['symbol'],
+            'action': trade['action'],
+            'shares': trade['shares'],
+            'price': trade['price'],
+            'total_cost': trade['total'],
+            'timestamp': stats['last_trade_at']
+        }] + self.history[:HISTORY_SIZE - 1]
+
+        return UserState(user, positions, history, self.orders, self.loaded_at, self._memo)
+
+# Per-process LRU of UserState by user_id. An entry is served only while no
+# notification has carried a newer state_version for its user, so a hit
+# costs no query. A stale entry is kept until replaced: a trade's
+# notification usually arrives before the trading request writes the trade
+# through, which then brings the entry up to date. The cache only serves
+# while its listener is connected; on (re)connecting it starts empty, since
+# changes may have been missed in between.
+class UserStateCache:
+    def __init__(self, size=CACHE_SIZE, ttl=TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # Latest version notified per user, so a read that raced a change
+        # isn't cached after the change's notification was handled
+        self._notified = OrderedDict()
+        self._lock = threading.Lock()
+        self._listening = False
+        self._conn = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+            'write_throughs': 0
+        }
+
+    # The cached state of the session's user, or None
+    def get(self, user_id, session_id):
+        with self._lock:
+            state = self._entries.get(user_id) if self._listening else None
+            if state is not None and time.monotonic() - state.loaded_at > self.ttl:
+                del self._entries[user_id]
+                state = None
+            if (state is None or state.user['session_id'] != session_id
+                    or state.version < self._notified.get(user_id, -1)):
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self._stats['hits'] += 1
+            return state
+
+    def put(self, state):
+        user_id = state.user['user_id']
+        with self._lock:
+            if not self._listening or self._notified.get(user_id, -1) > state.version:
+                return
+            current = self._entries.get(user_id)
+            if current is not None and current.version > state.version:
+                return
+            self._entries[user_id] = state
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    # Write a trade made by this process through to the user's entry. It
+    # applies only on top of the version just before the trade; otherwise
+    # some other change is missing from the entry, so it is dropped.
+    def apply_trade(self, result):
+        user_id = result['user_id']
+        with self._lock:
+            state = self._entries.get(user_id)
+            if state is None:
+                return
+            if state.version != result['state_version'] - 1:
+                del self._entries[user_id]
+                return
+            self._entries[user_id] = state.with_trade(result)
+            self._stats['write_throughs'] += 1
+
+    def invalidate(self, user_id, version):
+        with self._lock:
+            if version <= self._notified.get(user_id, -1):
+                return
+            self._notified[user_id] = version
+            self._notified.move_to_end(user_id)
+            while len(self._notified) > self.size:
+                self._notified.popitem(last=False)
+            state = self._entries.get(user_id)
+            if state is not None and state.version < version:
+                self._stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._notified.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        return stats
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='user-state', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self._close_connection()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._conn is None:
+                    self._connect()
+                for notify in self._conn.notifies(timeout=1.0):
+                    change = json.loads(notify.payload)
+                    self.invalidate(change['user_id'], change['version'])
+            except Exception as e:
+                print(f"User state listener error: {e}")
+                self._close_connection()
+                self._stop.wait(1)
+
+    # LISTEN needs a session of its own, like the price stream's listener
+    def _connect(self):
+        self._conn = psycopg.connect(
+            os.environ.get('DATABASE_URL'),
+            row_factory=dict_row,
+            autocommit=True
+        )
+        self._conn.execute(f'LISTEN {USER_STATE_CHANNEL}')
+        with self._lock:
+            self._entries.clear()
+            self._notified.clear()
+            self._listening = True
+
+    def _close_connection(self):
+        with self._lock:
+            self._listening = False
+            self._entries.clear()
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+_cache = None
+_cache_pid = None
+_cache_lock = threading.Lock()
+
+# Get this process's user state cache, starting its listener on first use
+def get_user_state_cache():
+    global _cache, _cache_pid
+
+    if _cache is not None and _cache_pid == os.getpid():
+        return _cache
+
+    with _cache_lock:
+        if _cache is None or _cache_pid != os.getpid():
+            _cache = UserStateCache()
+            _cache_pid = os.getpid()
+            _cache.start()
+            atexit.register(_cache.stop)
+
+    return _cache
+
+# A trade filled by this process; result is a successful execute_trade()
+# result
+def apply_trade(result):
+    get_user_state_cache().apply_trade(result)
+
+# Bump the state_version of users whose orders or badges changed and notify
+# every process, inside the caller's transaction (delivered on commit)
+def touch_users(cur, user_ids):
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return
+    cur.execute('''
+        UPDATE users
+        SET state_version = state_version + 1
+        WHERE user_id = ANY(%s)
+        RETURNING pg_notify(%s, json_build_object('user_id', user_id, 'version', state_version)::text)
+    ''', (user_ids, USER_STATE_CHANNEL))
+
+# Cache counters for /metrics
+def _collect_metrics():
+    if _cache is None or _cache_pid != os.getpid():
+        return []
+
+    stats = _cache.stats()
+    return [
+        ('trading_user_state_entries', 'gauge', 'Users whose state is cached in this process.',
+         [({}, stats['entries'])]),
+        ('trading_user_state_lookups_total', 'counter', 'User state cache lookups by result.',
+         [({'result': 'hit'}, stats['hits']), ({'result': 'miss'}, stats['misses'])]),
+        ('trading_user_state_invalidations_total', 'counter', 'Cached users dropped after a change elsewhere.',
+         [({}, stats['invalidations'])]),
+        ('trading_user_state_write_throughs_total', 'counter', 'Trades written through to a cached user.',
+         [({}, stats['write_throughs'])])
+    ]
+
+# Register the cache's metrics with an app
+def init_app(app):
+    register_collector(_collect_metrics)